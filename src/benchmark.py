@@ -0,0 +1,312 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.getcwd())
+
+from bot import Bot
+from checkpoint import load_qtable
+import game
+from game import GameEnv, checkCrash, mainGame, showWelcomeAnimation
+from hitmasks import load_collision_table, load_hitmasks
+import kernel
+from qtable import QTable
+from vecenv import VecEnv
+
+# Fixed-seed workloads timing the pieces of the training loop, results are written as JSON so runs
+# on different commits can be compared
+
+
+class RecordingPolicy(object):
+    """
+    Stand-in for the Bot that flaps at random and learns nothing, so mainGame runs on its own
+    Keeps every observation it is shown and every action it took, for replaying them
+    """
+
+    def __init__(self, rng, flap_rate=0.08):
+        self.rng = rng
+        self.flap_rate = flap_rate
+        self.observations = []
+        self.actions = []
+
+    def act(self, xdif, ydif, vel):
+        self.observations.append((xdif, ydif, vel))
+        self.actions.append(self.rng.random() < self.flap_rate)
+        return self.actions[-1]
+
+    def update_scores(self, dump_qvalues=True, censored=False):
+        pass
+
+
+def percentiles(samples):
+    samples = np.asarray(samples, dtype=float)
+    if not len(samples):
+        return {}
+    p50, p90, p99 = np.percentile(samples, [50, 90, 99])
+    return {"p50": p50, "p90": p90, "p99": p99, "max": samples.max(), "mean": samples.mean()}
+
+
+def bench_env(collisions, games, seed):
+    """Headless mainGame frames/sec, with a random policy instead of the Bot"""
+    env = GameEnv(seed)
+    policy = RecordingPolicy(env.explore_rng)
+    start = time.perf_counter()
+    for _ in range(games):
+        mainGame(showWelcomeAnimation(), policy, collisions, env)
+    elapsed = time.perf_counter() - start
+    frames = len(policy.observations)
+    return {
+        "games": games,
+        "frames": frames,
+        "seconds": elapsed,
+        "frames_per_sec": frames / elapsed,
+        "games_per_sec": games / elapsed,
+    }, policy.observations
+
+
+def bench_vecenv(hitmasks, n, steps, seed, step=None):
+    """
+    Batched VecEnv frames/sec, flapping at random, stepped by the given kernel function
+    The kernel is warmed up on a throwaway game first, so numba's compile time is not timed
+    """
+    VecEnv(1, hitmasks, seed, step).step(np.zeros(1, dtype=bool))
+    env = VecEnv(n, hitmasks, seed, step)
+    rng = np.random.default_rng(seed)
+    actions = rng.random((steps, n)) < 0.08
+    start = time.perf_counter()
+    for step_actions in actions:
+        env.step(step_actions)
+    elapsed = time.perf_counter() - start
+    return {"games": n, "steps": steps, "seconds": elapsed, "frames_per_sec": n * steps / elapsed}
+
+
+def check_kernel(collisions, games, seed, step):
+    """
+    Plays random games with mainGame, then replays their flaps through the kernel step function on
+    the same pipes, one game at a time
+    Returns the number of frames compared and of games where the kernel differs from mainGame in
+    any observation, or in the final score, length, player, pipes or kind of crash
+    """
+    gaps = GameEnv(seed).pregenerate(10000)
+    env, replay = GameEnv(seed, gaps), GameEnv(gaps=gaps)
+    policy = RecordingPolicy(env.explore_rng)
+    frames = mismatches = 0
+    for _ in range(games):
+        first = len(policy.observations)
+        crashInfo = mainGame(showWelcomeAnimation(), policy, collisions, env)
+
+        y, vel = np.array([float(kernel.START_Y)]), np.array([-9])
+        played, score, n_pipes = np.zeros(1, dtype=np.int64), np.zeros(1, dtype=np.int64), np.array([2])
+        pipe_x = np.array([[game.SCREENWIDTH + 200, game.SCREENWIDTH + 200 + game.SCREENWIDTH / 2, 0]])
+        pipe_gap_y = np.array([[replay.next_gap(), replay.next_gap(), 0]])
+        crashed, ground, spawned = np.zeros(1, dtype=bool), np.zeros(1, dtype=bool), np.zeros(1, dtype=bool)
+        observations = []
+        while not crashed[0] and len(observations) < len(policy.observations) - first:
+            observations.append(tuple(a[0] for a in kernel.observe(y, vel, pipe_x, pipe_gap_y)))
+            step(np.array([policy.actions[first + len(observations) - 1]]), y, vel, played, score,
+                 pipe_x, pipe_gap_y, n_pipes, collisions.table, collisions.dx_min, collisions.dy_min,
+                 crashed, ground, spawned)
+            if spawned[0]:
+                pipe_gap_y[0, n_pipes[0] - 1] = replay.next_gap()
+
+        n = int(n_pipes[0])
+        frames += len(observations)
+        mismatches += not (
+            observations == policy.observations[first:]
+            and crashed[0] and (score[0], played[0], ground[0], y[0], vel[0]) == (
+                crashInfo["score"], crashInfo["frames"], crashInfo["groundCrash"], crashInfo["y"],
+                crashInfo["playerVelY"])
+            and list(pipe_x[0, :n]) == [p["x"] for p in crashInfo["lowerPipes"]]
+            and list(pipe_gap_y[0, :n] + game.PIPEGAPSIZE) == [p["y"] for p in crashInfo["lowerPipes"]]
+        )
+    return {"games": games, "frames": frames, "mismatches": mismatches}
+
+
+def bench_act(bot, observations):
+    """Bot.act calls/sec, replaying recorded observations"""
+    start = time.perf_counter()
+    for i, (xdif, ydif, vel) in enumerate(observations):
+        bot.act(xdif, ydif, vel)
+        if i % 4096 == 4095:
+            bot.moves.clear()
+    elapsed = time.perf_counter() - start
+    bot.moves.clear()
+    bot.pending.clear()
+    return {"calls": len(observations), "seconds": elapsed, "calls_per_sec": len(observations) / elapsed}
+
+
+def bench_training(bot, collisions, games, seed):
+    """The training loop in games/sec, and the latency of Bot.update_scores at every death"""
+    env = GameEnv(seed)
+    bot.rng = env.explore_rng
+    act, update_scores = bot.act, bot.update_scores
+    latencies = []
+    frames = [0]
+
+    def counted_act(xdif, ydif, vel):
+        frames[0] += 1
+        return act(xdif, ydif, vel)
+
+    def timed_update_scores(dump_qvalues=True, censored=False):
+        start = time.perf_counter()
+        update_scores(dump_qvalues, censored)
+        latencies.append(time.perf_counter() - start)
+
+    bot.act, bot.update_scores = counted_act, timed_update_scores
+    scores = []
+    start = time.perf_counter()
+    try:
+        for _ in range(games):
+            scores.append(mainGame(showWelcomeAnimation(), bot, collisions, env)["score"])
+    finally:
+        del bot.act, bot.update_scores
+    elapsed = time.perf_counter() - start
+    return {
+        "games": games,
+        "frames": frames[0],
+        "seconds": elapsed,
+        "games_per_sec": games / elapsed,
+        "frames_per_sec": frames[0] / elapsed,
+        "mean_score": float(np.mean(scores)),
+        "update_scores_ms": {k: 1000 * v for k, v in percentiles(latencies).items()},
+    }
+
+
+def bench_check_crash(collisions, games, seed):
+    """checkCrash cost per call, on the frames of randomly played games"""
+    env = GameEnv(seed)
+    policy = RecordingPolicy(env.explore_rng)
+    calls = []
+
+    def record(player, upperPipes, lowerPipes, collisions):
+        calls.append((dict(player), [dict(p) for p in upperPipes], [dict(p) for p in lowerPipes]))
+        return checkCrash(player, upperPipes, lowerPipes, collisions)
+
+    game.checkCrash = record
+    try:
+        for _ in range(games):
+            mainGame(showWelcomeAnimation(), policy, collisions, env)
+    finally:
+        game.checkCrash = checkCrash
+
+    start = time.perf_counter()
+    for player, upperPipes, lowerPipes in calls:
+        checkCrash(player, upperPipes, lowerPipes, collisions)
+    elapsed = time.perf_counter() - start
+    return {"calls": len(calls), "seconds": elapsed, "us_per_call": 1e6 * elapsed / len(calls)}
+
+
+def bench_io(qtable, repeat):
+    """Load and dump times of the Q table, in the JSON and the binary format"""
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for name, ext in (("json", ".json"), ("binary", ".qtb")):
+            path = os.path.join(folder, "qvalues" + ext)
+            dumps, loads = [], []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                qtable.dump(path)
+                dumps.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                qtable.snapshot().load(path)
+                loads.append(time.perf_counter() - start)
+            results[name] = {
+                "bytes": os.path.getsize(path),
+                "dump_ms": 1000 * min(dumps),
+                "load_ms": 1000 * min(loads),
+            }
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser("benchmark.py")
+    parser.add_argument("--games", type=int, default=200, help="games played by each workload")
+    parser.add_argument("--vec-games", type=int, default=256, help="games run at once by the VecEnv")
+    parser.add_argument("--vec-steps", type=int, default=500, help="steps of the VecEnv workload")
+    parser.add_argument("--io-repeat", type=int, default=3, help="load/dump rounds, the best is kept")
+    parser.add_argument("--seed", type=int, default=0, help="seed of every workload")
+    parser.add_argument("--qvalues", default="qvalues.json", help="Q table the Bot starts from")
+    parser.add_argument("--learning", choices=Bot.LEARNING_MODES, default="sweep")
+    parser.add_argument("--output", default="benchmark.json", help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    hitmasks = load_hitmasks("../data/hitmasks_data.pkl")
+    collisions = load_collision_table(hitmasks, "../data/collision_table.npz")
+    # Learn on a private copy, the Q table file is never written: an attached table is not folded
+    # back into the file on exit
+    qtable = QTable()
+    load_qtable(qtable, os.path.join("../data", args.qvalues))
+    qtable.values = np.array(qtable.values)
+    bot = Bot(args.qvalues, learning=args.learning, qtable=qtable)
+    bot.gameCNT = 500  # past the exploration decay
+    initial = bot.qtable.snapshot()
+
+    results = {}
+    results["env"], observations = bench_env(collisions, args.games, args.seed)
+    results["vecenv"] = bench_vecenv(hitmasks, args.vec_games, args.vec_steps, args.seed)
+    results["kernel"] = {"jit": kernel.step_jit is not None, "vecenv_1": {}, "parity": {}}
+    kernels = [("numpy", kernel.step_numpy), ("loop", kernel.step_loop)]
+    if kernel.step_jit is not None:
+        kernels.append(("jit", kernel.step_jit))
+    for name, step in kernels:
+        results["kernel"]["vecenv_1"][name] = bench_vecenv(hitmasks, 1, args.vec_steps, args.seed, step)
+        results["kernel"]["parity"][name] = check_kernel(collisions, args.games, args.seed, step)
+    results["act"] = bench_act(bot, observations)
+    bot.qtable.values[:] = initial.values
+    results["training"] = bench_training(bot, collisions, args.games, args.seed)
+    results["check_crash"] = bench_check_crash(collisions, args.games, args.seed)
+    results["io"] = bench_io(initial, args.io_repeat)
+
+    report = {
+        "commit": git_commit(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "config": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w") as fil:
+        json.dump(report, fil, indent=2)
+
+    print("env          %10.0f frames/s  %8.1f games/s" % (
+        results["env"]["frames_per_sec"], results["env"]["games_per_sec"]))
+    print("vecenv       %10.0f frames/s  (%s kernel)" % (
+        results["vecenv"]["frames_per_sec"], "jit" if results["kernel"]["jit"] else "numpy"))
+    for name, single in results["kernel"]["vecenv_1"].items():
+        parity = results["kernel"]["parity"][name]
+        print("kernel %-5s %10.0f frames/s  1 game, %d/%d games differ from mainGame" % (
+            name, single["frames_per_sec"], parity["mismatches"], parity["games"]))
+    print("act          %10.0f calls/s" % results["act"]["calls_per_sec"])
+    print("training     %10.0f frames/s  %8.1f games/s" % (
+        results["training"]["frames_per_sec"], results["training"]["games_per_sec"]))
+    print("update_scores  p50 %.3f ms  p90 %.3f ms  p99 %.3f ms" % tuple(
+        results["training"]["update_scores_ms"].get(k, 0) for k in ("p50", "p90", "p99")))
+    print("checkCrash   %10.2f us/call" % results["check_crash"]["us_per_call"])
+    for name, io in results["io"].items():
+        print("%-12s %10.1f ms dump  %8.1f ms load  (%d bytes)" % (
+            name, io["dump_ms"], io["load_ms"], io["bytes"]))
+    print("Results written to " + args.output)
+
+    failed = [name for name, parity in results["kernel"]["parity"].items() if parity["mismatches"]]
+    if failed:
+        sys.exit("kernel parity check failed: " + ", ".join(failed))
+
+
+if __name__ == "__main__":
+    main()
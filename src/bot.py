@@ -1,67 +1,147 @@
-import json
+from collections import deque
 import os
 import random
 
+import numpy as np
+
+from checkpoint import Checkpointer, list_checkpoints
+from experience import ExperienceBuffer
+from discretizer import StateCache
+from qtable import GridError, QTable
+from replay import EpisodeReplay
+from sparse_qtable import SparseQTable
+
 
 class Bot(object):
     """
     The Bot class that applies the Qlearning logic to Flappy bird game
     After every iteration (iteration = 1 game that ends with the bird dying) updates Q values
-    After every DUMPING_N iterations, dumps the Q values to the local JSON file
+    After every DUMPING_N iterations, dumps the Q values to the local JSON file, on a background thread
+    The Q values file may also be a binary table (see qtable.py), memory-mapped copy-on-write
+
+    learning selects when the Q values are updated:
+    "sweep" - backward over the whole episode after death (default)
+    "td0" - one-step Q-learning inside act(), two frames behind so the death reward still applies
+    "td_lambda" - as td0, with eligibility traces (naive Q(lambda)) spreading each update backwards
+
+    grid selects the state grid (see discretizer.py), the Q values file must have been made for it
+    state_cache > 0 memoizes map_state on that many raw inputs (see StateCache)
+    sparse keeps only the states reached so far (see SparseQTable); every evict_every games the cold
+    ones (fewer than evict_min_visits updates, none in the last evict_idle games) are dropped
+    qtable is a ready-made table to play from and learn into (e.g. a worker's SharedQTable) instead
+    of loading the Q values file; grid and sparse then come from it, and the file is never folded
     """
 
-    def __init__(self):
+    LEARNING_MODES = ("sweep", "td0", "td_lambda")
+
+    def __init__(self, qvalues_file="qvalues.json", keep_checkpoints=3, horizon=None,
+                 learning="sweep", grid="10x10",
+                 state_cache=0, cache_eviction="lru", sparse=False, qtable=None):
         self.gameCNT = 0  # Game count of current run, incremented after every death
         self.DUMPING_N = 25  # Number of iterations to dump Q values to JSON after
+        self.COMPACT_N = 20  # Number of dumps to fold the logged changes into the JSON after
+        self.dumpCNT = 0
         self.discount = 1
         self.r = {0: 1, 1: -1000}  # Reward function
         self.lr = 0.7
+        self.trace_decay = 0.9  # lambda of td_lambda
+        self.trace_min = 0.01  # traces below this are dropped
+        self.rng = random  # exploration draws, GameEnv.explore_rng for reproducible runs
+        self.evict_every = 0  # sparse table: games between evictions, 0 never evicts
+        self.evict_min_visits = 1
+        self.evict_idle = 500
 
         # 获取项目根目录路径
         current_dir = os.path.dirname(os.path.abspath(__file__))
         self.project_root = os.path.dirname(current_dir)
         self.data_dir = os.path.join(self.project_root, 'data')
+        self.qvalues_file = qvalues_file
 
-        self.load_qvalues()
-        self.last_state = "420_240_0"
+        if qtable is None:
+            self.qtable = SparseQTable(grid) if sparse else QTable(grid)
+        else:
+            self.qtable = qtable
+            sparse = isinstance(qtable, SparseQTable)
+        self.discretizer = self.qtable.discretizer
+        # Without the grid the checkpointer doesn't fold the file on exit, which an attached table
+        # was not loaded from
+        self.checkpointer = Checkpointer(
+            os.path.join(self.data_dir, qvalues_file), keep_checkpoints,
+            self.discretizer if qtable is None else None, sparse
+        )
+        # A sparse table hands out its own states, a dense one is indexed by grid cell directly
+        self.lookup = self.qtable.index if sparse else self.discretizer.index
+        self.state_cache = None
+        self.replay = None  # EpisodeReplay of past episodes, see use_replay
+        self.replay_sweeps = 0
+        if state_cache > 0:
+            self.use_state_cache(state_cache, cache_eviction)
+        if qtable is None:
+            self.load_qvalues()
+        self.last_state = self.map_state(420, 240, 0)
         self.last_action = 0
-        self.moves = []
+        # Experiences deeper than horizon frames are learned from while the episode is still running
+        self.moves = ExperienceBuffer(horizon=horizon, on_overflow=self.stream_update)
+
+        if learning not in self.LEARNING_MODES:
+            raise ValueError("unknown learning mode: %s" % learning)
+        self.learning = learning
+        self.pending = deque()  # online modes: experiences not yet known to be far from death
+        self.last_jump = None  # online modes: newest flap that left pending
+        self.traces = {}  # td_lambda: flat index of (state, action) in qvalues -> eligibility
 
     def load_qvalues(self):
         """
-        Load q values from a JSON file
+        Load q values from a JSON (or binary) file
         """
-        self.qvalues = {}
-        qvalues_path = os.path.join(self.data_dir, "qvalues.json")
-        try:
-            with open(qvalues_path, "r") as fil:
-                self.qvalues = json.load(fil)
-        except (IOError, json.JSONDecodeError):
-            # 如果文件不存在或格式错误，初始化一个空字典
+        qvalues_path = os.path.join(self.data_dir, self.qvalues_file)
+        # 文件损坏时，依次尝试最近的检查点
+        candidates = [qvalues_path] + [fname for _, fname in list_checkpoints(qvalues_path)]
+        for path in candidates:
+            try:
+                self.qtable.load(path, mode="c")
+                if path != qvalues_path:
+                    print(f"Q-values file invalid. Loaded checkpoint {path}.")
+                break
+            except GridError:
+                # loading the file as an empty table would overwrite it on the next dump
+                raise
+            except (IOError, ValueError):
+                continue
+        else:
+            # 如果文件不存在或格式错误，初始化为全零
             print(f"Q-values file not found or invalid. Initializing empty Q-values.")
-            self.qvalues = {}
-            # 初始化一些基础状态
-            self.qvalues = {"420_240_0": [0.0, 0.0]}
+            self.qtable.clear()
+        # 重放上次合并之后记录的增量
+        self.checkpointer.log.replay(self.qtable)
+
+    @property
+    def qvalues(self):
+        """The Q values array, read through the table since a sparse one reallocates it as it grows"""
+        return self.qtable.values
 
-    import random
+    @qvalues.setter
+    def qvalues(self, values):
+        self.qtable.values = values
 
     def act(self, xdif, ydif, vel):
         state = self.map_state(xdif, ydif, vel)
 
-        if state not in self.qvalues:
-            self.qvalues[state] = [0.0, 0.0]
-
-        self.moves.append((self.last_state, self.last_action, state))
+        if self.learning == "sweep":
+            self.moves.append((self.last_state, self.last_action, state))
+        else:
+            self.td_step((self.last_state, self.last_action, state))
         self.last_state = state
 
         # === 新增：ε-greedy 探索 ===
         epsilon = max(0.05, 1.0 - self.gameCNT / 500.0)  # 前500局从1.0衰减到0.05
 
-        if random.random() < epsilon:
-            action = random.choice([0, 1])  # 随机探索
+        if self.rng.random() < epsilon:
+            action = self.rng.choice([0, 1])  # 随机探索
         else:
             # 贪心选择（tie-break 优先不跳）
-            if self.qvalues[state][0] >= self.qvalues[state][1]:
+            qs = self.qvalues[state]
+            if qs[0] >= qs[1]:
                 action = 0
             else:
                 action = 1
@@ -69,99 +149,260 @@ class Bot(object):
         self.last_action = action
         return action
 
-    def update_scores(self, dump_qvalues=True):
+    def update_scores(self, dump_qvalues=True, censored=False):
         """
         Update qvalues via iterating over experiences
+        censored tells that the game was cut short by a frame/score cap rather than ended by a death,
+        its experiences then only get the survival rewards
         """
-        if not self.moves:
+        if self.learning != "sweep":
+            self.td_terminal(dump_qvalues, censored)
             return
 
-        history = list(reversed(self.moves))
+        if not len(self.moves):
+            return
+
+        self.learn_episode(self.moves.to_array(), censored)
+
+        self.gameCNT += 1
+        if dump_qvalues:
+            self.dump_qvalues()
+        self.moves.clear()
+        if self.evict_every and self.gameCNT % self.evict_every == 0:
+            self.evict_cold_states()
+
+    def td_step(self, exp):
+        """
+        Online learning: the experience two frames back can no longer be one of the last two before
+        death, so it is updated now with its survival reward
+        """
+        self.pending.append(exp)
+        if len(self.pending) <= 2:
+            return
+        state, act, res_state = self.pending.popleft()
+        ydif = self.qtable.ydif[res_state]
+        reward = self.r[0] - 0.8 if (ydif < 40 or ydif > 160) else self.r[0]
+        self.td_update(state, act, res_state, reward)
+        if act == 1:
+            self.last_jump = (state, act, res_state)
 
-        # Flag if the bird died in the top pipe
-        try:
-            high_death_flag = True if int(history[0][2].split("_")[1]) > 120 else False
-        except (IndexError, ValueError):
-            high_death_flag = False
+    def td_terminal(self, dump_qvalues=True, censored=False):
+        """
+        Online learning at death: the last two experiences, and the last jump before a top pipe
+        death, get the death reward, as in the backward sweep
+        A censored game has no death, its last experiences get their survival rewards
+        """
+        if self.pending and censored:
+            history = np.array(self.pending, dtype=np.int64)
+            rewards = self.rewards(history[:, 1], history[:, 2], terminal=False)
+            for (state, act, res_state), reward in zip(self.pending, rewards.tolist()):
+                self.td_update(state, act, res_state, reward)
+        elif self.pending:
+            high_death_flag = self.qtable.ydif[self.pending[-1][2]] > 120
+            # Only the death itself travels back along the traces, the other death rewards would
+            # stack the same penalty again on every traced pair
+            for i, (state, act, res_state) in enumerate(reversed(self.pending)):
+                self.td_update(state, act, res_state, self.r[1], traced=i == 0)
+            if high_death_flag and self.last_jump is not None:
+                self.td_update(*self.last_jump, self.r[1], traced=False)
 
-        t = 1
-        for exp in history:
-            state = exp[0]
-            act = exp[1]
-            res_state = exp[2]
+        if self.pending:
+            self.gameCNT += 1
+            if dump_qvalues:
+                self.dump_qvalues()
 
-            if state not in self.qvalues:
-                self.qvalues[state] = [0.0, 0.0]
-            if res_state not in self.qvalues:
-                self.qvalues[res_state] = [0.0, 0.0]
+        self.pending.clear()
+        self.last_jump = None
+        self.traces = {}
+        if self.evict_every and self.gameCNT % self.evict_every == 0:
+            self.evict_cold_states()
 
-            # === 方案四：基础存活奖励 + 危险区域惩罚 ===
-            try:
-                ydif = int(res_state.split("_")[1])
-            except (IndexError, ValueError):
-                ydif = 100  # 默认安全高度
-
-            # 默认使用存活奖励 self.r[0]（即 +1）
-            cur_reward = self.r[0]
-
-            # 危险区域惩罚：抑制贴管飞行
-            if ydif < 40:          # 飞得太高（接近上管道）
-                cur_reward -= 0.8
-            elif ydif > 160:       # 飞得太低（接近地面）
-                cur_reward -= 0.8
-
-            # 死亡情况：覆盖为 self.r[1]（-1000）
-            if t == 1 or t == 2:
-                cur_reward = self.r[1]
-            elif high_death_flag and act == 1:
-                cur_reward = self.r[1]
-                high_death_flag = False
-
-            # Q-learning 更新
-            try:
-                self.qvalues[state][act] = (1 - self.lr) * self.qvalues[state][act] + \
-                                           self.lr * (cur_reward + self.discount * max(self.qvalues[res_state]))
-            except (IndexError, TypeError, ValueError) as e:
-                print(f"Error updating Q-values for state {state}: {e}")
-                self.qvalues[state] = [0.0, 0.0]
+    def td_update(self, state, act, res_state, reward, traced=True):
+        """
+        One Q-learning update, spread along the eligibility traces in td_lambda mode unless not traced
+        td_lambda is Watkins's Q(lambda): the traces are cut after an exploratory action, and visiting
+        a state replaces the traces of both its actions
+        On a shared table only the updated state's stripe is locked, the trace updates are Hogwild
+        """
+        q = self.qvalues
+        self.qtable.visits[state] += 1
+        self.qtable.dirty[state] = True
+        self.qtable.last_game[state] = self.gameCNT
 
-            t += 1
+        with self.qtable.locked((state,)):
+            target = reward + self.discount * max(q[res_state, 0], q[res_state, 1])
+            if self.learning == "td0" or not traced:
+                q[state, act] = (1 - self.lr) * q[state, act] + self.lr * target
+                return
+
+            flat = q.reshape(-1)
+            delta = target - flat[2 * state + act]
+            greedy = q[state, act] >= q[state, 1 - act]
+        if not greedy:
+            # Watkins: the return after an exploratory action says nothing about the greedy policy
+            self.traces = {}
+        # replacing traces
+        self.traces.pop(2 * state + 1 - act, None)
+        self.traces[2 * state + act] = 1.0
+        decay = self.discount * self.trace_decay
+        traces = {}
+        for index, trace in self.traces.items():
+            flat[index] += self.lr * delta * trace
+            trace *= decay
+            if trace >= self.trace_min:
+                traces[index] = trace
+            else:
+                self.qtable.dirty[index // 2] = True
+        self.traces = traces
+
+    def stream_update(self, chunk):
+        """
+        Learn from a chunk of experiences that fell more than the horizon behind the running episode
+        They are far enough from death that only the survival rewards apply
+        """
+        history = chunk[::-1]
+        states, acts, res_states = history[:, 0], history[:, 1], history[:, 2]
+        self.backward_update(states, acts, res_states, self.rewards(acts, res_states, terminal=False))
+
+    def rewards(self, acts, res_states, terminal=True):
+        """
+        Rewards of an episode's experiences, given last experience first
+        terminal tells whether the last experience is the bird's death
+        """
+        # === 方案四：基础存活奖励 + 危险区域惩罚 ===
+        ydif = self.qtable.ydif[res_states]
+
+        # 默认使用存活奖励 self.r[0]（即 +1）
+        # 危险区域惩罚：抑制贴管飞行，飞得太高（接近上管道）或太低（接近地面）
+        rewards = np.where((ydif < 40) | (ydif > 160), self.r[0] - 0.8, float(self.r[0]))
+        if not terminal:
+            return rewards
+
+        # 死亡情况：覆盖为 self.r[1]（-1000）
+        rewards[:2] = self.r[1]
+
+        # Flag if the bird died in the top pipe, the last jump before death gets punished
+        if ydif[0] > 120:
+            jumps = np.nonzero(acts[2:] == 1)[0]
+            if len(jumps):
+                rewards[jumps[0] + 2] = self.r[1]
+
+        return rewards
+
+    def learn_episode(self, episode, censored=False):
+        """
+        Sweep a whole episode, an (n, 3) array of (state, action, next state) in play order
+        With a replay store, the episode is then stored and replay_sweeps past episodes are swept again
+        """
+        # last experience first
+        history = episode[::-1]
+        states, acts, res_states = history[:, 0], history[:, 1], history[:, 2]
+        change = self.backward_update(states, acts, res_states,
+                                      self.rewards(acts, res_states, terminal=not censored))
+        if self.replay is None:
+            return
+
+        cells = self.qtable.grid_index(np.append(episode[:, 0], episode[-1, 2]))
+        self.replay.add(cells, episode[:, 1], censored, change)
+        for i in self.replay.sample(self.replay_sweeps):
+            cells, acts, res_cells, censored = self.replay.episode(i)
+            states = self.qtable.cell_states(cells[::-1])
+            res_states = self.qtable.cell_states(res_cells[::-1])
+            acts = acts[::-1]
+            self.replay.update(i, self.backward_update(
+                states, acts, res_states, self.rewards(acts, res_states, terminal=not censored)))
+
+    def backward_update(self, states, acts, res_states, rewards):
+        """
+        Q-learning updates over experiences given last experience first
+        Each update may read a row written by the previous one, so the recurrence runs in a plain
+        loop over Python floats, on a local copy of just the rows the episode touches
+        Returns the summed absolute change of those rows
+        """
+        np.add.at(self.qtable.visits, states, 1)
+        self.qtable.dirty[states] = True
+        self.qtable.last_game[states] = self.gameCNT
+
+        rows, inverse = np.unique(np.concatenate((states, res_states)), return_inverse=True)
+        n = len(states)
+        lr, discount = self.lr, self.discount
+
+        # On a shared table, no other process updates these rows in between the read and the write
+        # (with stripes), and only the entries the sweep changed are written back, so rows it only
+        # read keep what other processes wrote meanwhile (Hogwild)
+        with self.qtable.locked(rows):
+            before = self.qvalues[rows]
+            local = before.tolist()
+            for s, act, res, cur_reward in zip(inverse[:n].tolist(), acts.tolist(),
+                                               inverse[n:].tolist(), rewards.tolist()):
+                # Q-learning 更新
+                q = local[s]
+                q[act] = (1 - lr) * q[act] + lr * (cur_reward + discount * max(local[res]))
+
+            after = np.array(local)
+            r, c = np.nonzero(after != before)
+            self.qvalues[rows[r], c] = after[r, c]
+            return float(np.abs(after - before).sum())
 
-        self.gameCNT += 1
-        if dump_qvalues:
-            self.dump_qvalues()
-        self.moves = []
-    
     def map_state(self, xdif, ydif, vel):
         """
         Map the (xdif, ydif, vel) to the respective state, with regards to the grids
-        The state is a string, "xdif_ydif_vel"
+        The state is the integer row of the grid cell in the Q table
+        """
+        if self.state_cache is not None:
+            return self.state_cache(xdif, ydif, vel)
+        return self.lookup(xdif, ydif, vel)
 
-        X -> [-40,-30...120] U [140, 210 ... 420]
-        Y -> [-300, -290 ... 160] U [180, 240 ... 420]
+    def use_state_cache(self, maxsize, eviction="lru"):
         """
-        if xdif < 140:
-            xdif = int(xdif) - (int(xdif) % 10)
-        else:
-            xdif = int(xdif) - (int(xdif) % 70)
+        Memoize map_state on up to maxsize raw inputs, or stop memoizing if maxsize is 0
+        """
+        self.state_cache = StateCache(self.lookup, maxsize, eviction) if maxsize > 0 else None
 
-        if ydif < 180:
-            ydif = int(ydif) - (int(ydif) % 10)
-        else:
-            ydif = int(ydif) - (int(ydif) % 60)
+    def use_replay(self, sweeps, capacity=500000, alpha=0.6):
+        """
+        Sweep sweeps past episodes, drawn by priority, after every game, or stop replaying if sweeps is 0
+        """
+        self.replay_sweeps = sweeps
+        self.replay = EpisodeReplay(capacity, alpha, self.rng) if sweeps > 0 else None
 
-        return str(int(xdif)) + "_" + str(int(ydif)) + "_" + str(vel)
+    def evict_cold_states(self):
+        """
+        Drop the cold states of a sparse table, between games (the states held for the running game
+        are renumbered)
+        Returns the number of states evicted
+        """
+        if not isinstance(self.qtable, SparseQTable):
+            return 0
+        last_cell = int(self.qtable.cells[self.last_state])
+        remap = self.qtable.evict(self.evict_min_visits, self.evict_idle, self.gameCNT)
+        # the state the next game starts from comes back if it was evicted
+        self.last_state = self.qtable.slot(last_cell)
+        if self.state_cache is not None:
+            # the states were renumbered, but the hit rate of the run still holds
+            self.state_cache.clear(counters=False)
+        return int((remap < 0).sum())
 
     def dump_qvalues(self, force=False):
         """
-        Dump the qvalues to the JSON file
+        Dump the qvalues to the JSON (or binary) file
+        Only a snapshot is taken here, the checkpointer writes it in the background
+        Usually only the states changed since the last dump are appended to the delta log,
+        every COMPACT_N dumps (and on forced dumps) the whole table is written instead
         """
         if self.gameCNT % self.DUMPING_N == 0 or force:
-            qvalues_path = os.path.join(self.data_dir, "qvalues.json")
-
             # 确保data目录存在
             os.makedirs(self.data_dir, exist_ok=True)
 
-            with open(qvalues_path, "w") as fil:
-                json.dump(self.qvalues, fil)
-            print(f"Q-values updated on local file. Game count: {self.gameCNT}")
\ No newline at end of file
+            self.dumpCNT += 1
+            if force or self.dumpCNT % self.COMPACT_N == 0:
+                self.checkpointer.submit(self.gameCNT, self.qtable.snapshot())
+            else:
+                # States still on an eligibility trace may have changed without being marked
+                for index in self.traces:
+                    self.qtable.dirty[index // 2] = True
+                states = np.nonzero(self.qtable.dirty)[0]
+                self.checkpointer.submit_delta(
+                    self.gameCNT, self.qtable.grid_index(states), self.qvalues[states]
+                )
+            self.qtable.dirty[:] = False
\ No newline at end of file
@@ -0,0 +1,263 @@
+import atexit
+import glob
+import os
+import re
+import shutil
+import struct
+import threading
+import time
+
+import numpy as np
+
+from discretizer import Discretizer
+from qtable import GridError, QTable
+from sparse_qtable import SparseQTable
+
+
+def list_checkpoints(path):
+    """
+    Checkpoints kept for the Q table at path, as (game count, file) pairs, newest first
+    """
+    root, ext = os.path.splitext(os.path.basename(path))
+    folder = os.path.join(os.path.dirname(path), "checkpoints")
+    pattern = re.compile(re.escape(root) + r"\.(\d+)" + re.escape(ext) + "$")
+
+    checkpoints = []
+    for fname in glob.glob(os.path.join(folder, root + ".*" + ext)):
+        match = pattern.match(os.path.basename(fname))
+        if match:
+            checkpoints.append((int(match.group(1)), fname))
+    return sorted(checkpoints, reverse=True)
+
+
+def load_qtable(qtable, path, mode="c"):
+    """
+    Load the Q table file at path with the changes of its delta log on top, as every reader of a
+    table that is being trained should; mode "c" keeps a binary file itself unchanged
+    Returns the number of logged records applied
+    """
+    qtable.load(path, mode)
+    return DeltaLog(path).replay(qtable)
+
+
+class DeltaLog(object):
+    """
+    Append-only log of changed Q table rows, stored next to the Q table file as <file>.delta
+    Records hold absolute values, so replaying a record that is already in the base table is harmless
+    Records are keyed by grid cell (see QTable.grid_index), so they replay into dense and sparse tables
+    The header holds the grid the cells are on (its X, Y and V edges follow it as int32), a log
+    written for another grid is rejected; the grid is only needed to append
+    """
+
+    MAGIC = b"QDLT"
+    VERSION = 2
+    HEADER = struct.Struct("<4sHIII")  # magic, version, nx, ny, nv
+    HEADER_V1 = struct.Struct("<4sHI")  # magic, version, unused
+    RECORD = np.dtype([("state", "<i4"), ("q", "<f8", (2,))])
+
+    def __init__(self, path, grid=None):
+        self.path = path + ".delta"
+        self.discretizer = grid if grid is None or isinstance(grid, Discretizer) else Discretizer(grid)
+
+    def _header(self):
+        d = self.discretizer
+        bins = np.array(d.bins, dtype="<i4").tobytes()
+        return self.HEADER.pack(self.MAGIC, self.VERSION, d.nx, d.ny, d.nv) + bins
+
+    def append(self, cells, rows):
+        """
+        Append the rows of the given grid cells, returns the number of bytes written
+        """
+        records = np.empty(len(cells), dtype=self.RECORD)
+        records["state"] = cells
+        records["q"] = rows
+        if self.discretizer is None:
+            raise ValueError("the grid of the delta log is needed to append to it")
+        with open(self.path, "ab") as fil:
+            written = 0
+            if fil.tell() == 0:
+                written += fil.write(self._header())
+            written += fil.write(records.tobytes())
+        return written
+
+    def replay(self, qtable):
+        """
+        Apply the logged rows on top of qtable.values, returns the number of records applied
+        A record cut short by a crash during an append is ignored
+        Raises GridError if the log was written for another grid than qtable's
+        """
+        try:
+            with open(self.path, "rb") as fil:
+                data = fil.read()
+        except IOError:
+            return 0
+        if len(data) < self.HEADER_V1.size or self.HEADER_V1.unpack_from(data)[0] != self.MAGIC:
+            return 0
+
+        version = self.HEADER_V1.unpack_from(data)[1]
+        if version == 1:
+            # written before logs recorded their grid
+            start = self.HEADER_V1.size
+        else:
+            if len(data) < self.HEADER.size:
+                return 0
+            _, _, nx, ny, nv = self.HEADER.unpack_from(data)
+            start = self.HEADER.size + 4 * (nx + ny + nv)
+            bins = np.frombuffer(data[self.HEADER.size:start], dtype="<i4").tolist()
+            d = qtable.discretizer
+            if (nx, ny, nv) != (d.nx, d.ny, d.nv) or bins != d.bins:
+                raise GridError("%s was written for a different state grid" % self.path)
+
+        body = data[start:]
+        body = body[:len(body) - len(body) % self.RECORD.itemsize]
+        records = np.frombuffer(body, dtype=self.RECORD)
+        # Later records win: fancy assignment keeps the last write of a repeated index
+        qtable.assign(records["state"], records["q"])
+        return len(records)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def reset(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Checkpointer(object):
+    """
+    Writes Q table snapshots on a background thread, so the game loop never waits on disk I/O
+    Every write goes to a temp file that is atomically renamed, first as checkpoints/<name>.<game>.<ext>
+    (keeping the newest `keep` of them), then over the Q table file itself
+    If snapshots come in faster than they are written, only the newest pending one is written
+    Between full snapshots, submit_delta() appends only the changed rows to a DeltaLog, a full
+    snapshot folds the log back into the Q table file
+    With the grid of the table (and whether it is sparse), close() folds a log still pending into
+    the Q table file as well, so readers that don't replay the log don't see a stale table
+    """
+
+    def __init__(self, path, keep=3, grid=None, sparse=False):
+        self.path = path
+        self.keep = keep
+        self.sparse = sparse
+        self.folder = os.path.join(os.path.dirname(path), "checkpoints")
+        self.log = DeltaLog(path, grid)
+        self.write_times = []  # seconds taken by each write
+
+        self._pending = []
+        self._busy = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, game_cnt, qtable):
+        """
+        Queue a snapshot for writing, qtable must not be modified afterwards (see QTable.snapshot)
+        """
+        with self._cond:
+            # A full snapshot supersedes everything still waiting to be written
+            self._pending = [(game_cnt, qtable, None)]
+            self._cond.notify_all()
+
+    def submit_delta(self, game_cnt, cells, rows):
+        """
+        Queue the changed rows (a copy of qtable.values[states]) and their grid cells
+        (qtable.grid_index(states)) for appending to the delta log
+        """
+        with self._cond:
+            self._pending.append((game_cnt, None, (cells, rows)))
+            self._cond.notify_all()
+
+    def flush(self):
+        """
+        Block until every submitted snapshot has been written
+        """
+        with self._cond:
+            while self._pending or self._busy:
+                self._cond.wait()
+
+    def close(self):
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.fold()
+
+    def fold(self):
+        """
+        Rewrite the Q table file with its delta log applied and drop the log
+        Only once every submitted write is done, and only with the grid of the table
+        """
+        if self.log.discretizer is None or not self.log.exists():
+            return
+        table = (SparseQTable if self.sparse else QTable)(self.log.discretizer)
+        try:
+            load_qtable(table, self.path)
+            self._atomic_dump(table, self.path)
+        except (IOError, OSError, ValueError) as e:
+            print(f"Error folding the Q-values changes into {self.path}: {e}")
+            return
+        self.log.reset()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                game_cnt, qtable, delta = self._pending.pop(0)
+                self._busy = True
+            try:
+                if delta is None:
+                    self._write(game_cnt, qtable)
+                else:
+                    self._write_delta(game_cnt, *delta)
+            except (IOError, OSError) as e:
+                print(f"Error writing Q-values checkpoint at game {game_cnt}: {e}")
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    def _write(self, game_cnt, qtable):
+        start = time.perf_counter()
+        root, ext = os.path.splitext(os.path.basename(self.path))
+        os.makedirs(self.folder, exist_ok=True)
+
+        if self.keep > 0:
+            checkpoint = os.path.join(self.folder, "%s.%d%s" % (root, game_cnt, ext))
+            self._atomic_dump(qtable, checkpoint)
+
+            # Publish the checkpoint as the Q table file
+            tmp_path = os.path.join(os.path.dirname(self.path), "%s.publish.tmp%s" % (root, ext))
+            shutil.copyfile(checkpoint, tmp_path)
+            os.replace(tmp_path, self.path)
+
+            for _, fname in list_checkpoints(self.path)[self.keep:]:
+                os.remove(fname)
+        else:
+            self._atomic_dump(qtable, self.path)
+        # The snapshot already holds every logged change
+        self.log.reset()
+
+        elapsed = time.perf_counter() - start
+        self.write_times.append(elapsed)
+        print(f"Q-values updated on local file. Game count: {game_cnt} ({elapsed:.3f}s)")
+
+    def _write_delta(self, game_cnt, cells, rows):
+        start = time.perf_counter()
+        written = self.log.append(cells, rows)
+        elapsed = time.perf_counter() - start
+        self.write_times.append(elapsed)
+        print(f"Q-values changes logged ({len(cells)} states, {written} bytes). "
+              f"Game count: {game_cnt} ({elapsed:.3f}s)")
+
+    @staticmethod
+    def _atomic_dump(qtable, path):
+        root, ext = os.path.splitext(path)
+        tmp_path = root + ".tmp" + ext
+        qtable.dump(tmp_path)
+        os.replace(tmp_path, path)
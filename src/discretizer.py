@@ -0,0 +1,177 @@
+from collections import OrderedDict
+
+import numpy as np
+
+# The grids a state can be discretized on, as the lower edge of every bin along X, Y and V
+GRIDS = {
+    # X -> [-40,-30...130] U [140, 210 ... 420]
+    # Y -> [-300, -290 ... 170] U [180, 240 ... 420]
+    "10x10": (
+        list(range(-40, 140, 10)) + list(range(140, 421, 70)),
+        list(range(-300, 180, 10)) + list(range(180, 421, 60)),
+        list(range(-10, 11)),
+    ),
+    # X -> [-40,-35...135] U [140, 210 ... 420]
+    # Y -> [-300, -295 ... 175] U [180, 240 ... 420]
+    "5x5": (
+        list(range(-40, 140, 5)) + list(range(140, 421, 70)),
+        list(range(-300, 180, 5)) + list(range(180, 421, 60)),
+        list(range(-10, 11)),
+    ),
+}
+
+
+class Discretizer(object):
+    """
+    Maps raw (xdif, ydif, vel) to the integer state of its grid cell
+    A value falls in the bin with the highest lower edge not above it, values outside the grid are
+    clamped to the closest edge cell
+    The bin of every integer offset between the first and the last edge is precomputed once, already
+    scaled by the stride of its axis, so a lookup is three list reads and two additions
+    A state is the row (x_bin * ny + y_bin) * nv + v_bin of the cell
+    """
+
+    def __init__(self, grid="10x10"):
+        if isinstance(grid, str):
+            if grid not in GRIDS:
+                raise ValueError("unknown grid: %s" % grid)
+            self.name = grid
+            grid = GRIDS[grid]
+        else:
+            self.name = None
+        self.x_bins, self.y_bins, self.v_bins = (list(bins) for bins in grid)
+        for bins in (self.x_bins, self.y_bins, self.v_bins):
+            if not bins or any(b >= c for b, c in zip(bins, bins[1:])):
+                raise ValueError("grid bins must be non-empty and strictly increasing")
+
+        self.nx, self.ny, self.nv = len(self.x_bins), len(self.y_bins), len(self.v_bins)
+        self.n_states = self.nx * self.ny * self.nv
+
+        self.x_min, self.x_max = self.x_bins[0], self.x_bins[-1]
+        self.y_min, self.y_max = self.y_bins[0], self.y_bins[-1]
+        self.v_min, self.v_max = self.v_bins[0], self.v_bins[-1]
+        self.x_lut = self._lut(self.x_bins) * (self.ny * self.nv)
+        self.y_lut = self._lut(self.y_bins) * self.nv
+        self.v_lut = self._lut(self.v_bins)
+        self.index = self._make_index()
+
+    @staticmethod
+    def _lut(bins):
+        """Bin index of every integer from the first to the last edge"""
+        return np.searchsorted(bins, np.arange(bins[0], bins[-1] + 1), side="right") - 1
+
+    @property
+    def bins(self):
+        """The X, Y and V edges, concatenated"""
+        return self.x_bins + self.y_bins + self.v_bins
+
+    def _make_index(self):
+        """
+        The scalar lookup as a closure over plain lists, faster than numpy arrays and attribute reads
+        """
+        x_lut, y_lut, v_lut = self.x_lut.tolist(), self.y_lut.tolist(), self.v_lut.tolist()
+        x_min, y_min, v_min = self.x_min, self.y_min, self.v_min
+        x_top, y_top, v_top = len(x_lut) - 1, len(y_lut) - 1, len(v_lut) - 1
+
+        def index(xdif, ydif, vel):
+            """
+            The state of a single raw (xdif, ydif, vel)
+            """
+            x = int(xdif) - x_min
+            y = int(ydif) - y_min
+            v = int(vel) - v_min
+            return x_lut[0 if x < 0 else x_top if x > x_top else x] + \
+                y_lut[0 if y < 0 else y_top if y > y_top else y] + \
+                v_lut[0 if v < 0 else v_top if v > v_top else v]
+
+        return index
+
+    def indices(self, xdif, ydif, vel):
+        """
+        Vectorized index() over arrays of raw values
+        """
+        x = np.clip(np.asarray(xdif).astype(np.int64), self.x_min, self.x_max)
+        y = np.clip(np.asarray(ydif).astype(np.int64), self.y_min, self.y_max)
+        v = np.clip(np.asarray(vel).astype(np.int64), self.v_min, self.v_max)
+        return self.x_lut[x - self.x_min] + self.y_lut[y - self.y_min] + self.v_lut[v - self.v_min]
+
+    def cells(self):
+        """
+        The (xdif, ydif, vel) bin edges of every state, as three arrays indexed by state
+        """
+        states = np.arange(self.n_states)
+        return (
+            np.array(self.x_bins)[states // (self.ny * self.nv)],
+            np.array(self.y_bins)[(states // self.nv) % self.ny],
+            np.array(self.v_bins)[states % self.nv],
+        )
+
+
+class StateCache(object):
+    """
+    Bounded memo of a state lookup, keyed on the raw (xdif, ydif, vel) it is called with
+    eviction picks what goes once maxsize keys are held:
+    "lru" - the least recently used key
+    "fifo" - the oldest key, hits don't reorder (cheaper than lru)
+    "clear" - every key, the cache refills from scratch
+    """
+
+    EVICTIONS = ("lru", "fifo", "clear")
+
+    def __init__(self, lookup, maxsize=4096, eviction="lru"):
+        if eviction not in self.EVICTIONS:
+            raise ValueError("unknown eviction policy: %s" % eviction)
+        if maxsize < 1:
+            raise ValueError("maxsize must be positive")
+        self.lookup = lookup
+        self.maxsize = maxsize
+        self.eviction = eviction
+        self.cache = OrderedDict() if eviction == "lru" else {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __call__(self, xdif, ydif, vel):
+        key = (xdif, ydif, vel)
+        cache = self.cache
+        try:
+            state = cache[key]
+        except KeyError:
+            pass
+        else:
+            self.hits += 1
+            if self.eviction == "lru":
+                cache.move_to_end(key)
+            return state
+
+        self.misses += 1
+        state = self.lookup(xdif, ydif, vel)
+        if len(cache) >= self.maxsize:
+            if self.eviction == "lru":
+                cache.popitem(last=False)
+            elif self.eviction == "fifo":
+                del cache[next(iter(cache))]
+            else:
+                self.evictions += len(cache) - 1
+                cache.clear()
+            self.evictions += 1
+        cache[key] = state
+        return state
+
+    def __len__(self):
+        return len(self.cache)
+
+    def hit_rate(self):
+        calls = self.hits + self.misses
+        return self.hits / calls if calls else 0.0
+
+    def clear(self, counters=True):
+        """Drop every key, and reset the counters unless counters is False"""
+        self.cache.clear()
+        if counters:
+            self.hits = self.misses = self.evictions = 0
+
+    def __str__(self):
+        return "%d hits, %d misses (%.1f%% hit rate), %d evictions, %d/%d keys" % (
+            self.hits, self.misses, 100 * self.hit_rate(), self.evictions, len(self.cache), self.maxsize
+        )
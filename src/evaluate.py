@@ -0,0 +1,196 @@
+import argparse
+import json
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.getcwd())
+
+from checkpoint import load_qtable
+from qtable import QTable
+from vecenv import VecEnv
+
+# Greedy evaluation of a Q table: no exploration, no learning, many games stepped at once
+
+
+def evaluate(qtable, games, batch=256, seed=None, hitmasks=None, max_frames=None, max_score=None,
+             frame_skip=1):
+    """
+    Play games greedy games with the read-only qtable, batch of them at a time on a VecEnv
+    Every game slot plays a fixed share of the games one after the other, so games still running
+    when the others are done can't bias the scores towards short games
+    A game reaching max_frames frames or a score of max_score is stopped there and censored, which
+    bounds the time an evaluation can take however good the policy is
+    With frame_skip k a game only looks up its action every k-th frame, as in mainGame
+    Returns the scores, the frames played and whether each game was censored, in the order the
+    games ended
+    """
+    if frame_skip < 1:
+        raise ValueError("frame_skip must be at least 1, got %r" % frame_skip)
+    batch = max(1, min(batch, games))
+    env = VecEnv(batch, hitmasks, seed)
+    quota = np.full(batch, games // batch)
+    quota[:games % batch] += 1
+    played = np.zeros(batch, dtype=np.int64)
+    values = qtable.values
+
+    scores, frames, censored = [], [], []
+    while (played < quota).any():
+        # tie-break towards not flapping, as Bot.act does
+        if frame_skip == 1:
+            states = qtable.discretizer.indices(*env.observe())
+            actions = values[states, 1] > values[states, 0]
+        else:
+            acting = np.nonzero(env.frames % frame_skip == 0)[0]
+            xdif, ydif, vel = env.observe()
+            states = qtable.discretizer.indices(xdif[acting], ydif[acting], vel[acting])
+            actions = np.zeros(batch, dtype=bool)
+            actions[acting] = values[states, 1] > values[states, 0]
+        lengths = env.frames.copy()
+        crashed, _, final = env.step(actions)
+
+        capped = np.zeros(batch, dtype=bool)
+        if max_frames is not None:
+            capped |= env.frames >= max_frames
+        if max_score is not None:
+            capped |= env.score >= max_score
+        capped &= ~crashed
+        lengths = np.where(capped, env.frames, lengths)
+        final = np.where(capped, env.score, final)
+        env.reset(capped)
+
+        ended = crashed | capped
+        counted = ended & (played < quota)
+        scores.extend(final[counted].tolist())
+        frames.extend(lengths[counted].tolist())
+        censored.extend(capped[counted].tolist())
+        played += ended
+    return np.array(scores, dtype=np.int64), np.array(frames, dtype=np.int64), np.array(censored)
+
+
+def quantile_interval(sorted_scores, q, z):
+    """
+    Distribution-free confidence interval of the q quantile, from the binomial spread of its rank
+    """
+    n = len(sorted_scores)
+    spread = z * math.sqrt(n * q * (1 - q))
+    lo = min(max(int(math.floor(n * q - spread)), 0), n - 1)
+    hi = min(max(int(math.ceil(n * q + spread)), 0), n - 1)
+    return int(sorted_scores[lo]), int(sorted_scores[hi])
+
+
+def score_stats(scores, z=1.96):
+    """
+    Mean, spread, percentiles and max of the scores, with confidence intervals (1.96: 95%)
+    """
+    scores = np.sort(np.asarray(scores))
+    n = len(scores)
+    mean = float(scores.mean())
+    std = float(scores.std(ddof=1)) if n > 1 else 0.0
+    half = z * std / math.sqrt(n)
+    stats = {
+        "games": n,
+        "mean": mean,
+        "std": std,
+        "mean_ci": [mean - half, mean + half],
+        "min": int(scores[0]),
+        "max": int(scores[-1]),
+        "percentiles": {},
+    }
+    for p in (5, 25, 50, 75, 95):
+        stats["percentiles"][str(p)] = {
+            "value": float(np.percentile(scores, p)),
+            "ci": list(quantile_interval(scores, p / 100.0, z)),
+        }
+    return stats
+
+
+def survival_stats(scores, frames, censored, z=1.96):
+    """
+    What the censored games say about the policy:
+    survival - share of the games that reached the cap, with a Wilson score interval
+    death_rate - deaths per frame over all frames played, assuming a constant hazard
+    projected_frames / projected_score - mean game length under that hazard, and the mean score
+    it would give at the observed score rate (scores per frame); None without any death
+    """
+    n = len(scores)
+    survived = int(np.sum(censored))
+    deaths = n - survived
+    exposure = int(np.sum(frames))
+
+    p = survived / n
+    center = (p + z * z / (2 * n)) / (1 + z * z / n)
+    half = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    stats = {
+        "censored": survived,
+        "survival": p,
+        "survival_ci": [max(center - half, 0.0), min(center + half, 1.0)],
+        "frames": exposure,
+        "death_rate": deaths / exposure if exposure else None,
+        "score_rate": float(np.sum(scores)) / exposure if exposure else None,
+        "projected_frames": None,
+        "projected_score": None,
+    }
+    if deaths:
+        stats["projected_frames"] = exposure / deaths
+        stats["projected_score"] = float(np.sum(scores)) / deaths
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser("evaluate.py")
+    parser.add_argument(
+        "qvalues", nargs="?", default="../data/qvalues.json", help="Q table to evaluate, .json or binary"
+    )
+    parser.add_argument("--games", type=int, default=1000, help="number of games to play")
+    parser.add_argument("--batch", type=int, default=256, help="games stepped at once")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the pipes")
+    parser.add_argument("--grid", default="10x10", help="state grid of the table (10x10 or 5x5)")
+    parser.add_argument("--max-frames", type=int, default=None, help="stop games at this many frames")
+    parser.add_argument("--max-score", type=int, default=None, help="stop games at this score")
+    parser.add_argument(
+        "--frame-skip", type=int, default=1, help="act every N frames, as the table was trained with"
+    )
+    parser.add_argument("--output", default=None, help="also write the statistics to this JSON file")
+    args = parser.parse_args()
+    if args.frame_skip < 1:
+        parser.error("--frame-skip must be at least 1")
+
+    qtable = QTable(args.grid)
+    load_qtable(qtable, args.qvalues)
+    qtable.values.flags.writeable = False
+
+    start = time.perf_counter()
+    scores, frames, censored = evaluate(
+        qtable, args.games, args.batch, args.seed, max_frames=args.max_frames, max_score=args.max_score,
+        frame_skip=args.frame_skip
+    )
+    elapsed = time.perf_counter() - start
+    stats = score_stats(scores)
+    stats["survival"] = survival_stats(scores, frames, censored)
+    stats["seconds"] = elapsed
+
+    print("%d games in %.2fs" % (stats["games"], elapsed))
+    print("mean %.2f (95%% CI %.2f - %.2f), std %.2f, min %d, max %d" % (
+        stats["mean"], stats["mean_ci"][0], stats["mean_ci"][1], stats["std"], stats["min"], stats["max"]))
+    for p, entry in stats["percentiles"].items():
+        print("p%-3s %8.1f (95%% CI %d - %d)" % (p, entry["value"], entry["ci"][0], entry["ci"][1]))
+    survival = stats["survival"]
+    if survival["censored"]:
+        print("%d games censored at the cap, their scores are lower bounds" % survival["censored"])
+        print("survival to the cap %.3f (95%% CI %.3f - %.3f)" % (
+            survival["survival"], survival["survival_ci"][0], survival["survival_ci"][1]))
+        if survival["projected_score"] is not None:
+            print("projected mean game %.0f frames, mean score %.1f (constant death rate)" % (
+                survival["projected_frames"], survival["projected_score"]))
+
+    if args.output:
+        with open(args.output, "w") as fil:
+            json.dump(stats, fil, indent=2)
+
+
+if __name__ == "__main__":
+    main()
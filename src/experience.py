@@ -0,0 +1,72 @@
+import numpy as np
+
+
+class ExperienceBuffer(object):
+    """
+    The experiences (state, action, next state) of the running episode, held in preallocated
+    (chunk_size, 3) int32 chunks instead of one tuple per frame
+    The newest experiences are staged in a short list and sealed into a chunk once it fills up
+    With a horizon, a chunk whose experiences are all more than horizon frames old is handed to
+    on_overflow (oldest experience first) and dropped, so memory stays bounded however long the
+    episode runs; the horizon must be at least 2, so that the last two experiences, which get the
+    death reward, are always held back
+    """
+
+    MAX_SPARE = 4  # emptied chunks kept around for reuse
+
+    def __init__(self, chunk_size=4096, horizon=None, on_overflow=None):
+        self.chunk_size = chunk_size
+        self.horizon = horizon  # validated by the setter
+        self.on_overflow = on_overflow
+        self.chunks = []  # sealed chunks, oldest first
+        self.staging = []
+        self._spare = []
+
+    @property
+    def horizon(self):
+        return self._horizon
+
+    @horizon.setter
+    def horizon(self, horizon):
+        if horizon is not None and horizon < 2:
+            raise ValueError("horizon must be at least 2, got %d" % horizon)
+        self._horizon = horizon
+
+    def __len__(self):
+        return len(self.chunks) * self.chunk_size + len(self.staging)
+
+    def append(self, exp):
+        self.staging.append(exp)
+        if len(self.staging) == self.chunk_size:
+            self._seal()
+
+    def _seal(self):
+        chunk = self._spare.pop() if self._spare else np.empty((self.chunk_size, 3), dtype=np.int32)
+        chunk[:] = self.staging
+        self.staging = []
+        self.chunks.append(chunk)
+
+        if self.horizon is None or self.on_overflow is None:
+            return
+        # Every experience of the oldest chunk is followed by at least horizon newer ones
+        while (len(self.chunks) - 1) * self.chunk_size >= self.horizon:
+            chunk = self.chunks.pop(0)
+            self.on_overflow(chunk)
+            self._recycle(chunk)
+
+    def _recycle(self, chunk):
+        if len(self._spare) < self.MAX_SPARE:
+            self._spare.append(chunk)
+
+    def to_array(self):
+        """
+        All held experiences as one (n, 3) int32 array, oldest first
+        """
+        staged = np.array(self.staging, dtype=np.int32).reshape(-1, 3)
+        return np.concatenate(self.chunks + [staged])
+
+    def clear(self):
+        for chunk in self.chunks:
+            self._recycle(chunk)
+        self.chunks = []
+        self.staging = []
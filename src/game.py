@@ -0,0 +1,280 @@
+from itertools import cycle
+import random
+
+import numpy as np
+
+# Headless game core shared by the training scripts, pygame is only needed to render the game
+
+SCREENWIDTH = 288
+SCREENHEIGHT = 512
+# amount by which base can maximum shift to left
+PIPEGAPSIZE = 100  # gap between upper and lower part of pipe
+BASEY = SCREENHEIGHT * 0.79
+
+# image width height indices for ease of use
+IM_WIDTH = 0
+IM_HEIGTH = 1
+# image, Width, Height
+PIPE = [52, 320]
+PLAYER = [34, 24]
+BASE = [336, 112]
+BACKGROUND = [288, 512]
+
+
+class GameEnv(object):
+    """
+    Seeded randomness of headless games, one stream for the pipe gaps and one for the bot's exploration
+    (see Bot.rng), so that changing how often the bot explores doesn't change the pipes it meets
+    With gaps, the pipes come from that pre-generated array instead (see pregenerate), cycling if it
+    runs out, so every run meets the exact same pipes
+    """
+
+    def __init__(self, seed=None, gaps=None):
+        master = random.Random(seed)
+        self.pipe_rng = random.Random(master.getrandbits(64))
+        self.explore_rng = random.Random(master.getrandbits(64))
+        self.gaps = None if gaps is None else [int(gap) for gap in gaps]
+        self.gap_pos = 0  # next gap taken from gaps
+
+    def next_gap(self):
+        """y of gap between upper and lower pipe"""
+        if self.gaps is None:
+            return randomGap(self.pipe_rng)
+        gap = self.gaps[self.gap_pos]
+        self.gap_pos = (self.gap_pos + 1) % len(self.gaps)
+        return gap
+
+    def pregenerate(self, n):
+        """
+        The next n gaps of the pipe stream as an int array, a fixed corpus for GameEnv(gaps=...)
+        """
+        return np.array([randomGap(self.pipe_rng) for _ in range(n)], dtype=np.int64)
+
+
+def showWelcomeAnimation():
+    """Movement info the welcome screen hands over to mainGame"""
+    # index of player to blit on screen
+    playerIndexGen = cycle([0, 1, 2, 1])
+
+    playery = int((SCREENHEIGHT - PLAYER[IM_HEIGTH]) / 2)
+
+    basex = 0
+
+    # player shm for up-down motion on welcome screen
+    playerShmVals = {"val": 0, "dir": 1}
+
+    return {
+        "playery": playery + playerShmVals["val"],
+        "basex": basex,
+        "playerIndexGen": playerIndexGen,
+    }
+
+
+def mainGame(movementInfo, bot, collisions, env=None, profiler=None, max_frames=None,
+             max_score=None, frame_skip=1):
+    """
+    Plays one game with bot choosing the actions, until the bird crashes
+    Pipes come from env (a GameEnv) if given, from the global random module otherwise
+    profiler (an instrument.Profiler) if given times every phase of the frames
+    A game reaching max_frames frames or a score of max_score is stopped there, its crash info
+    then has "censored" set: the score is only a lower bound of what the bird would have made
+    With frame_skip k the bot only acts on every k-th frame, so it learns from transitions k frames
+    apart; physics and crash checks still run every frame. A flap is a single impulse, the frames in
+    between don't flap (repeating it would just hold the velocity at playerFlapAcc)
+    Returns the crash info, after the bot has updated its Q values
+    """
+    if frame_skip < 1:
+        raise ValueError("frame_skip must be at least 1, got %r" % frame_skip)
+
+    score = playerIndex = loopIter = frames = 0
+    playerIndexGen = movementInfo["playerIndexGen"]
+
+    playerx, playery = int(SCREENWIDTH * 0.2), movementInfo["playery"]
+
+    basex = movementInfo["basex"]
+    baseShift = BASE[IM_WIDTH] - BACKGROUND[IM_WIDTH]
+
+    # get 2 new pipes to add to upperPipes lowerPipes list
+    newPipe1 = getRandomPipe(env)
+    newPipe2 = getRandomPipe(env)
+
+    # list of upper pipes
+    upperPipes = [
+        {"x": SCREENWIDTH + 200, "y": newPipe1[0]["y"]},
+        {"x": SCREENWIDTH + 200 + (SCREENWIDTH / 2), "y": newPipe2[0]["y"]},
+    ]
+
+    # list of lowerpipe
+    lowerPipes = [
+        {"x": SCREENWIDTH + 200, "y": newPipe1[1]["y"]},
+        {"x": SCREENWIDTH + 200 + (SCREENWIDTH / 2), "y": newPipe2[1]["y"]},
+    ]
+
+    pipeVelX = -4
+
+    # player velocity, max velocity, downward accleration, accleration on flap
+    playerVelY = -9  # player's velocity along Y, default same as playerFlapped
+    playerMaxVelY = 10  # max vel along Y, max descend speed
+    playerMinVelY = -8  # min vel along Y, max ascend speed
+    playerAccY = 1  # players downward accleration
+    playerFlapAcc = -9  # players speed on flapping
+    playerFlapped = False  # True when player flaps
+
+    while True:
+        if profiler is not None:
+            lap = profiler.clock()
+
+        if -playerx + lowerPipes[0]["x"] > -30:
+            myPipe = lowerPipes[0]
+        else:
+            myPipe = lowerPipes[1]
+
+        if frames % frame_skip == 0 and \
+                bot.act(-playerx + myPipe["x"], -playery + myPipe["y"], playerVelY):
+            if playery > -2 * PLAYER[IM_HEIGTH]:
+                playerVelY = playerFlapAcc
+                playerFlapped = True
+        if profiler is not None:
+            lap = profiler.lap("act", lap)
+
+        # check for crash here
+        crashTest = checkCrash(
+            {"x": playerx, "y": playery, "index": playerIndex}, upperPipes, lowerPipes, collisions
+        )
+        if profiler is not None:
+            lap = profiler.lap("check_crash", lap)
+        if crashTest[0]:
+            # Update the q scores
+            bot.update_scores(dump_qvalues=False)
+            if profiler is not None:
+                profiler.lap("update_scores", lap)
+                profiler.end_game()
+
+            return {
+                "y": playery,
+                "groundCrash": crashTest[1],
+                "basex": basex,
+                "upperPipes": upperPipes,
+                "lowerPipes": lowerPipes,
+                "score": score,
+                "playerVelY": playerVelY,
+                "frames": frames,
+                "censored": False,
+            }
+
+        # check for score
+        playerMidPos = playerx + PLAYER[IM_WIDTH] / 2
+        for pipe in upperPipes:
+            pipeMidPos = pipe["x"] + PIPE[IM_WIDTH] / 2
+            if pipeMidPos <= playerMidPos < pipeMidPos + 4:
+                score += 1
+        if profiler is not None:
+            lap = profiler.lap("score", lap)
+            profiler.count("frames")
+            if playerFlapped:
+                profiler.count("flaps")
+
+        # playerIndex basex change
+        if (loopIter + 1) % 3 == 0:
+            playerIndex = next(playerIndexGen)
+        loopIter = (loopIter + 1) % 30
+        basex = -((-basex + 100) % baseShift)
+
+        # player's movement
+        if playerVelY < playerMaxVelY and not playerFlapped:
+            playerVelY += playerAccY
+        if playerFlapped:
+            playerFlapped = False
+        playerHeight = PLAYER[IM_HEIGTH]
+        playery += min(playerVelY, BASEY - playery - playerHeight)
+        if profiler is not None:
+            lap = profiler.lap("player", lap)
+
+        # move pipes to left
+        for uPipe, lPipe in zip(upperPipes, lowerPipes):
+            uPipe["x"] += pipeVelX
+            lPipe["x"] += pipeVelX
+
+        # add new pipe when first pipe is about to touch left of screen
+        if 0 < upperPipes[0]["x"] < 5:
+            newPipe = getRandomPipe(env)
+            upperPipes.append(newPipe[0])
+            lowerPipes.append(newPipe[1])
+
+        # remove first pipe if its out of the screen
+        if upperPipes[0]["x"] < -PIPE[IM_WIDTH]:
+            upperPipes.pop(0)
+            lowerPipes.pop(0)
+        if profiler is not None:
+            profiler.lap("pipes", lap)
+
+        frames += 1
+        if (max_frames is not None and frames >= max_frames) or \
+                (max_score is not None and score >= max_score):
+            bot.update_scores(dump_qvalues=False, censored=True)
+            if profiler is not None:
+                profiler.count("censored")
+                profiler.end_game()
+
+            return {
+                "y": playery,
+                "groundCrash": False,
+                "basex": basex,
+                "upperPipes": upperPipes,
+                "lowerPipes": lowerPipes,
+                "score": score,
+                "playerVelY": playerVelY,
+                "frames": frames,
+                "censored": True,
+            }
+
+
+def randomGap(rng=random):
+    """y of gap between upper and lower pipe, drawn from rng"""
+    return rng.randrange(0, int(BASEY * 0.6 - PIPEGAPSIZE)) + int(BASEY * 0.2)
+
+
+def getRandomPipe(env=None):
+    """returns a randomly generated pipe, its gap taken from env if given"""
+    # y of gap between upper and lower pipe
+    gapY = randomGap() if env is None else env.next_gap()
+    pipeHeight = PIPE[IM_HEIGTH]
+    pipeX = SCREENWIDTH + 10
+
+    return [
+        {"x": pipeX, "y": gapY - pipeHeight},  # upper pipe
+        {"x": pipeX, "y": gapY + PIPEGAPSIZE},  # lower pipe
+    ]
+
+
+def checkCrash(player, upperPipes, lowerPipes, collisions):
+    """returns True if player collders with base or pipes."""
+    pi = player["index"]
+    player["w"] = PLAYER[IM_WIDTH]
+    player["h"] = PLAYER[IM_HEIGTH]
+
+    # if player crashes into ground
+    if (player["y"] + player["h"] >= BASEY - 1) or (player["y"] + player["h"] <= 0):
+        return [True, True]
+    else:
+
+        playerx, playery = int(player["x"]), int(player["y"])
+
+        for lPipe in lowerPipes:
+            # if bird collided with upipe or lpipe, looked up by the offset of the pipe pair
+            if collisions.hit(pi, int(lPipe["x"]) - playerx, int(lPipe["y"]) - playery):
+                return [True, False]
+
+    return [False, False]
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser("game.py")
+    parser.add_argument("output", help=".npy file to write a pipe gap corpus to, for learn.py --gaps")
+    parser.add_argument("--n", type=int, default=100000, help="number of pipe gaps")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the pipe stream")
+    args = parser.parse_args()
+
+    np.save(args.output, GameEnv(args.seed).pregenerate(args.n))
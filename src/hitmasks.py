@@ -0,0 +1,118 @@
+import hashlib
+import os
+import pickle
+
+import numpy as np
+
+
+def load_hitmasks(path=None):
+    """
+    Load the dumped hitmasks as boolean arrays indexed [x, y]
+    """
+    if path is None:
+        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        path = os.path.join(project_root, "data", "hitmasks_data.pkl")
+    with open(path, "rb") as input_file:
+        hitmasks = pickle.load(input_file)
+    return {
+        "player": tuple(np.array(mask, dtype=bool) for mask in hitmasks["player"]),
+        "pipe": tuple(np.array(mask, dtype=bool) for mask in hitmasks["pipe"]),
+    }
+
+
+def overlap(mask1, mask2, dx, dy):
+    """Checks if mask2, placed at (dx, dy) relative to mask1, overlaps it"""
+    x0, x1 = max(0, dx), min(mask1.shape[0], dx + mask2.shape[0])
+    y0, y1 = max(0, dy), min(mask1.shape[1], dy + mask2.shape[1])
+    if x0 >= x1 or y0 >= y1:
+        return False
+    return bool((mask1[x0:x1, y0:y1] & mask2[x0 - dx:x1 - dx, y0 - dy:y1 - dy]).any())
+
+
+def pixelCollision(rect1, rect2, hitmask1, hitmask2):
+    """Checks if two objects collide and not just their rects"""
+    rect = rect1.clip(rect2)
+
+    if rect.width == 0 or rect.height == 0:
+        return False
+
+    x1, y1 = rect.x - rect1.x, rect.y - rect1.y
+    x2, y2 = rect.x - rect2.x, rect.y - rect2.y
+
+    region1 = hitmask1[x1:x1 + rect.width, y1:y1 + rect.height]
+    region2 = hitmask2[x2:x2 + rect.width, y2:y2 + rect.height]
+    return bool((region1 & region2).any())
+
+
+class CollisionTable(object):
+    """
+    Whether the player collides with a pipe pair, precomputed for every relative offset
+    table[index, dx, dy] is True if player frame index collides with the pipe pair whose lower
+    pipe sits at (dx, dy) from the player's top-left corner (the upper pipe is gap + its height above)
+    Offsets outside the table can't collide
+    """
+
+    def __init__(self, hitmasks, gap=100):
+        players, (upper, lower) = hitmasks["player"], hitmasks["pipe"]
+        pw, ph = players[0].shape
+        qw, qh = lower.shape
+
+        # Lowest offsets at which the sprites can still touch
+        self.dx_min = 1 - qw
+        self.dy_min = 1 - qh
+        self.table = np.zeros((len(players), pw + qw - 1, ph + qh - 1 + gap + qh), dtype=bool)
+
+        for index, mask in enumerate(players):
+            for i in range(self.table.shape[1]):
+                dx = self.dx_min + i
+                for j in range(self.table.shape[2]):
+                    dy = self.dy_min + j
+                    self.table[index, i, j] = overlap(mask, lower, dx, dy) or \
+                        overlap(mask, upper, dx, dy - gap - qh)
+
+    @classmethod
+    def load(cls, hitmasks, path, gap=100):
+        """
+        Load the table cached at path, building and caching it if missing, unreadable or built from
+        other hitmasks
+        The cache is written to a temp file and renamed into place, so a reader never sees it torn
+        """
+        digest = hashlib.sha1(str(gap).encode())
+        for mask in hitmasks["player"] + hitmasks["pipe"]:
+            digest.update(np.ascontiguousarray(mask).tobytes())
+        digest = digest.hexdigest()
+
+        try:
+            cached = np.load(path)
+            if str(cached["digest"]) == digest:
+                table = cls.__new__(cls)
+                table.table = cached["table"]
+                table.dx_min, table.dy_min = (int(v) for v in cached["offset"])
+                return table
+        except Exception:
+            # any corrupt cache (a torn zip, a bad member, ...) is a miss
+            pass
+
+        table = cls(hitmasks, gap)
+        root, ext = os.path.splitext(path)
+        tmp_path = "%s.tmp%d%s" % (root, os.getpid(), ext)
+        np.savez(tmp_path, table=table.table, offset=[table.dx_min, table.dy_min], digest=digest)
+        os.replace(tmp_path, path)
+        return table
+
+    def hit(self, index, dx, dy):
+        """Single lookup, dx and dy are ints"""
+        i, j = dx - self.dx_min, dy - self.dy_min
+        if 0 <= i < self.table.shape[1] and 0 <= j < self.table.shape[2]:
+            return bool(self.table[index, i, j])
+        return False
+
+
+def load_collision_table(hitmasks, path=None, gap=100):
+    """
+    The CollisionTable of the given hitmasks, cached next to hitmasks_data.pkl by default
+    """
+    if path is None:
+        project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        path = os.path.join(project_root, "data", "collision_table.npz")
+    return CollisionTable.load(hitmasks, path, gap)
@@ -1,17 +1,18 @@
-import json
-from itertools import chain
+import argparse
 
-# Script to create Q-Value JSON file, initilazing with zeros
+from checkpoint import DeltaLog
+from qtable import QTable
+from sparse_qtable import SparseQTable
 
-qval = {}
-# X -> [-40,-30...120] U [140, 210 ... 490]
-# Y -> [-300, -290 ... 160] U [180, 240 ... 420]
-for x in chain(list(range(-40, 140, 10)), list(range(140, 421, 70))):
-    for y in chain(list(range(-300, 180, 10)), list(range(180, 421, 60))):
-        for v in range(-10, 11):
-            qval[str(x) + "_" + str(y) + "_" + str(v)] = [0, 0]
+# Script to create Q-Value JSON file, initilazing with zeros
 
+parser = argparse.ArgumentParser("initialize_qvalues.py")
+parser.add_argument("--grid", default="10x10", help="state grid of the table (10x10 or 5x5)")
+parser.add_argument("--output", default="../data/qvalues.json", help="Q table to write, .json or binary")
+parser.add_argument("--sparse", action="store_true", help="write no states, for Bot(sparse=True)")
+args = parser.parse_args()
 
-fd = open("../data/qvalues.json", "w")
-json.dump(qval, fd)
-fd.close()
+# Every cell of the grid (see discretizer.py) gets [0, 0], unless sparse
+(SparseQTable if args.sparse else QTable)(args.grid).dump(args.output)
+# changes logged for the previous table would be replayed onto the new one
+DeltaLog(args.output).reset()
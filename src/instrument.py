@@ -0,0 +1,108 @@
+import json
+import time
+
+# Per-phase timers for the game loop. mainGame only calls into a Profiler when it is given one, so
+# running without one costs a None check per phase
+
+
+class Profiler(object):
+    """
+    Times the phases of every frame and counts events, summarized every `every` games
+    Durations go into log2 histograms (bucket b holds durations of 2^(b-1) to 2^b - 1 ns), so
+    recording is a few integer operations and percentiles are accurate to a factor of 2
+    With window, the histograms are reset after each summary, so every summary covers the last
+    `every` games only; log, if given, is a file that every summary is appended to as a JSON line
+    """
+
+    BUCKETS = 48  # up to 2^47 ns, about 39 hours
+
+    def __init__(self, every=100, window=True, log=None):
+        self.every = every
+        self.window = window
+        self.log = log
+        self.clock = time.perf_counter_ns
+        self.games = 0
+        self.reset()
+
+    def reset(self):
+        self.histograms = {}  # phase -> list of bucket counts
+        self.totals = {}  # phase -> total ns
+        self.counters = {}
+        self.window_games = 0
+        self.window_start = self.clock()
+
+    def lap(self, phase, start):
+        """
+        Record the time since start against phase, returns the current clock to start the next phase
+        """
+        now = self.clock()
+        elapsed = now - start
+        histogram = self.histograms.get(phase)
+        if histogram is None:
+            histogram = self.histograms[phase] = [0] * self.BUCKETS
+            self.totals[phase] = 0
+        histogram[min(elapsed.bit_length(), self.BUCKETS - 1)] += 1
+        self.totals[phase] += elapsed
+        return now
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def end_game(self):
+        """
+        Called once a game is over, prints (and logs) a summary every `every` games
+        """
+        self.games += 1
+        self.window_games += 1
+        if self.every and self.games % self.every == 0:
+            self.report()
+            if self.window:
+                self.reset()
+
+    def percentile(self, phase, q):
+        """Upper bound, in ns, of the q-th percentile duration of phase"""
+        histogram = self.histograms[phase]
+        rank = q / 100.0 * sum(histogram)
+        seen = 0
+        for bucket, n in enumerate(histogram):
+            seen += n
+            if n and seen >= rank:
+                return (1 << bucket) - 1
+        return 0
+
+    def summary(self):
+        wall = self.clock() - self.window_start
+        timed = sum(self.totals.values())
+        phases = {}
+        for phase, histogram in self.histograms.items():
+            calls = sum(histogram)
+            phases[phase] = {
+                "calls": calls,
+                "total_ms": self.totals[phase] / 1e6,
+                "share": self.totals[phase] / timed if timed else 0.0,
+                "mean_ns": self.totals[phase] / calls,
+                "p50_ns": self.percentile(phase, 50),
+                "p99_ns": self.percentile(phase, 99),
+                "histogram": histogram[:max(b for b, n in enumerate(histogram) if n) + 1],
+            }
+        return {
+            "games": self.games,
+            "window_games": self.window_games,
+            "wall_ms": wall / 1e6,
+            "phases": phases,
+            "counters": dict(self.counters),
+        }
+
+    def report(self):
+        summary = self.summary()
+        print("Profile after game %d (%d games, %.0f ms):" % (
+            summary["games"], summary["window_games"], summary["wall_ms"]))
+        for phase, stats in sorted(summary["phases"].items(), key=lambda item: -item[1]["total_ms"]):
+            print("  %-14s %9d calls %9.1f ms %5.1f%%  mean %7.0f ns  p50 <%7d ns  p99 <%8d ns" % (
+                phase, stats["calls"], stats["total_ms"], 100 * stats["share"], stats["mean_ns"],
+                stats["p50_ns"], stats["p99_ns"]))
+        if summary["counters"]:
+            print("  " + ", ".join("%s: %d" % item for item in sorted(summary["counters"].items())))
+        if self.log:
+            with open(self.log, "a") as fil:
+                fil.write(json.dumps(summary) + "\n")
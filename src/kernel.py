@@ -0,0 +1,153 @@
+import numpy as np
+
+from game import BASEY, IM_HEIGTH, IM_WIDTH, PIPE, PIPEGAPSIZE, PLAYER, SCREENHEIGHT, SCREENWIDTH
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# One frame of headless games as a function over flat arrays of physics state, so a batch of games
+# costs a handful of array operations per frame, or a compiled loop when numba is installed
+
+PIPE_W, PIPE_H = PIPE[IM_WIDTH], PIPE[IM_HEIGTH]
+PLAYER_W, PLAYER_H = PLAYER[IM_WIDTH], PLAYER[IM_HEIGTH]
+PLAYER_X = int(SCREENWIDTH * 0.2)
+PLAYER_MID = PLAYER_X + PLAYER_W / 2
+START_Y = int((SCREENHEIGHT - PLAYER_H) / 2)
+
+PIPE_VEL_X = -4
+PLAYER_MAX_VEL_Y = 10  # max vel along Y, max descend speed
+PLAYER_ACC_Y = 1  # players downward accleration
+PLAYER_FLAP_ACC = -9  # players speed on flapping
+
+MAX_PIPES = 3  # a game never has more than 3 pipes on screen at once
+PLAYER_INDEX_CYCLE = np.array([0, 1, 2, 1])
+
+
+def step_numpy(actions, y, vel, frames, score, pipe_x, pipe_gap_y, n_pipes, table, dx_min, dy_min,
+               crashed, ground, spawned):
+    """
+    Advance every game by one frame, following the frame order of mainGame: flap, check crash,
+    score, move the player, move the pipes
+    actions - 0 (don't flap) / 1 (flap) per game
+    y, vel, frames, score - player height (float), velocity, frames played and score per game
+    pipe_x, pipe_gap_y, n_pipes - (n, MAX_PIPES) pipe slots, the first n_pipes of each row on
+    screen, leftmost first; pipe_gap_y is the y of the gap between the upper and lower pipe
+    table, dx_min, dy_min - the collision table of a hitmasks.CollisionTable
+    The state arrays are updated in place, and the outputs written to:
+    crashed, ground - whether each game crashed this frame, and into the ground; crashed games are
+    left as they crashed, the way mainGame returns them
+    spawned - whether a pipe was added to each game, in slot n_pipes - 1, its gap left for the caller
+    to fill in
+    """
+    on_screen = np.arange(MAX_PIPES) < n_pipes[:, None]
+    flap = (actions != 0) & (y > -2 * PLAYER_H)
+    np.copyto(vel, PLAYER_FLAP_ACC, where=flap)
+
+    # check for crash, one table lookup per pipe pair by the offset of the lower pipe
+    bottom = y + PLAYER_H
+    ground[:] = (bottom >= BASEY - 1) | (bottom <= 0)
+    k = frames // 3
+    index = np.where(k == 0, 0, PLAYER_INDEX_CYCLE[(k - 1) % 4])
+    i = pipe_x.astype(np.int64) - (PLAYER_X + dx_min)
+    j = pipe_gap_y + (PIPEGAPSIZE - dy_min) - y.astype(np.int64)[:, None]
+    inside = on_screen & (i >= 0) & (i < table.shape[1]) & (j >= 0) & (j < table.shape[2])
+    i = np.clip(i, 0, table.shape[1] - 1)
+    j = np.clip(j, 0, table.shape[2] - 1)
+    hit = inside & table[index[:, None], i, j]
+    crashed[:] = ground | hit.any(axis=1)
+    alive = ~crashed
+
+    # check for score
+    pipe_mid = pipe_x + PIPE_W / 2
+    passed = on_screen & (pipe_mid <= PLAYER_MID) & (PLAYER_MID < pipe_mid + 4)
+    score += passed.sum(axis=1) * alive
+
+    # player's movement
+    vel += PLAYER_ACC_Y * (alive & ~flap & (vel < PLAYER_MAX_VEL_Y))
+    y += np.where(alive, np.minimum(vel, BASEY - y - PLAYER_H), 0)
+    frames += alive
+
+    # move pipes to left
+    pipe_x += PIPE_VEL_X * alive[:, None]
+
+    # add new pipe when first pipe is about to touch left of screen
+    spawned[:] = alive & (0 < pipe_x[:, 0]) & (pipe_x[:, 0] < 5)
+    rows = np.nonzero(spawned)[0]
+    if len(rows):
+        pipe_x[rows, n_pipes[rows]] = SCREENWIDTH + 10
+        n_pipes[rows] += 1
+
+    # remove first pipe if its out of the screen
+    gone = alive & (pipe_x[:, 0] < -PIPE_W)
+    if gone.any():
+        pipe_x[gone, :-1] = pipe_x[gone, 1:]
+        pipe_gap_y[gone, :-1] = pipe_gap_y[gone, 1:]
+        n_pipes[gone] -= 1
+
+
+def step_loop(actions, y, vel, frames, score, pipe_x, pipe_gap_y, n_pipes, table, dx_min, dy_min,
+              crashed, ground, spawned):
+    """
+    step_numpy as a scalar loop over the games, written for numba to compile
+    Pipe slots past n_pipes are left untouched, where step_numpy moves them along
+    """
+    for g in range(len(y)):
+        flap = actions[g] != 0 and y[g] > -2 * PLAYER_H
+        if flap:
+            vel[g] = PLAYER_FLAP_ACC
+
+        bottom = y[g] + PLAYER_H
+        ground[g] = bottom >= BASEY - 1 or bottom <= 0
+        crashed[g] = ground[g]
+        k = frames[g] // 3
+        index = 0 if k == 0 else PLAYER_INDEX_CYCLE[(k - 1) % 4]
+        player_y = int(y[g])
+        for p in range(n_pipes[g]):
+            i = int(pipe_x[g, p]) - (PLAYER_X + dx_min)
+            j = pipe_gap_y[g, p] + (PIPEGAPSIZE - dy_min) - player_y
+            if 0 <= i < table.shape[1] and 0 <= j < table.shape[2] and table[index, i, j]:
+                crashed[g] = True
+        spawned[g] = False
+        if crashed[g]:
+            continue
+
+        for p in range(n_pipes[g]):
+            pipe_mid = pipe_x[g, p] + PIPE_W / 2
+            if pipe_mid <= PLAYER_MID < pipe_mid + 4:
+                score[g] += 1
+
+        if vel[g] < PLAYER_MAX_VEL_Y and not flap:
+            vel[g] += PLAYER_ACC_Y
+        y[g] += min(vel[g], BASEY - y[g] - PLAYER_H)
+        frames[g] += 1
+
+        for p in range(n_pipes[g]):
+            pipe_x[g, p] += PIPE_VEL_X
+        if 0 < pipe_x[g, 0] < 5:
+            pipe_x[g, n_pipes[g]] = SCREENWIDTH + 10
+            n_pipes[g] += 1
+            spawned[g] = True
+        if pipe_x[g, 0] < -PIPE_W:
+            for p in range(n_pipes[g] - 1):
+                pipe_x[g, p] = pipe_x[g, p + 1]
+                pipe_gap_y[g, p] = pipe_gap_y[g, p + 1]
+            n_pipes[g] -= 1
+
+
+step_jit = numba.njit(cache=True)(step_loop) if numba is not None else None
+
+# The fastest kernel available
+step = step_jit if step_jit is not None else step_numpy
+
+
+def observe(y, vel, pipe_x, pipe_gap_y):
+    """
+    The (xdif, ydif, vel) arrays that mainGame would pass to bot.act() this frame
+    """
+    rows = np.arange(len(y))
+    col = np.where(pipe_x[:, 0] - PLAYER_X > -30, 0, 1)
+    xdif = pipe_x[rows, col] - PLAYER_X
+    ydif = pipe_gap_y[rows, col] + PIPEGAPSIZE - y
+    return xdif, ydif, vel.copy()
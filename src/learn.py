@@ -1,266 +1,226 @@
-from itertools import cycle
-import random
 import sys
 import os
 import argparse
-import pickle
 
-import pygame
-from pygame.locals import *
+import numpy as np
 
 sys.path.append(os.getcwd())
 
 from bot import Bot
+from discretizer import StateCache
+from game import GameEnv, mainGame, showWelcomeAnimation
+from hitmasks import load_collision_table, load_hitmasks
+from evaluate import survival_stats
+from instrument import Profiler
+from qtable import GridError
 
 
-# Initialize the bot
-bot = Bot()
-
-SCREENWIDTH = 288
-SCREENHEIGHT = 512
-# amount by which base can maximum shift to left
-PIPEGAPSIZE = 100  # gap between upper and lower part of pipe
-BASEY = SCREENHEIGHT * 0.79
-
-# image width height indices for ease of use
-IM_WIDTH = 0
-IM_HEIGTH = 1
-# image, Width, Height
-PIPE = [52, 320]
-PLAYER = [34, 24]
-BASE = [336, 112]
-BACKGROUND = [288, 512]
+# The bot, created in main() once the grid is known
+bot = None
 
 
 def main():
-    global HITMASKS, ITERATIONS, VERBOSE, bot
+    global HITMASKS, COLLISIONS, ITERATIONS, VERBOSE, RESULTS, bot
 
     parser = argparse.ArgumentParser("learn.py")
     parser.add_argument("--iter", type=int, default=1000, help="number of iterations to run")
     parser.add_argument(
         "--verbose", action="store_true", help="output [iteration | score] to stdout"
     )
+    parser.add_argument(
+        "--workers", type=int, default=1, help="number of processes to train in parallel"
+    )
+    parser.add_argument(
+        "--sync", type=int, default=25, help="games each worker plays between Q value merges"
+    )
+    parser.add_argument(
+        "--merge", choices=["visits", "avg"], default="visits", help="how worker Q values are merged"
+    )
+    parser.add_argument(
+        "--horizon", type=int, default=None,
+        help="learn from experiences this many frames old during the game, bounding memory use"
+    )
+    parser.add_argument(
+        "--learning", choices=Bot.LEARNING_MODES, default="sweep",
+        help="update Q values after each game (sweep) or during it (td0, td_lambda)"
+    )
+    parser.add_argument(
+        "--state-cache", type=int, default=0,
+        help="memoize state mapping on this many raw inputs, printing the hit rate at the end"
+    )
+    parser.add_argument(
+        "--cache-eviction", choices=StateCache.EVICTIONS, default="lru",
+        help="which inputs the state cache drops when full"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=None,
+        help="seed the pipes and the exploration, for reproducible runs"
+    )
+    parser.add_argument(
+        "--gaps", default=None,
+        help="play the pipe gaps of this .npy file (see GameEnv.pregenerate) instead of random ones"
+    )
+    parser.add_argument(
+        "--profile", type=int, default=0,
+        help="time every phase of the game loop, printing a summary every N games"
+    )
+    parser.add_argument(
+        "--profile-log", default=None, help="also append every profile summary to this file, as JSON"
+    )
+    parser.add_argument(
+        "--max-frames", type=int, default=None,
+        help="stop a game at this many frames, learning from it as if the bird had lived on"
+    )
+    parser.add_argument("--max-score", type=int, default=None, help="stop a game at this score")
+    parser.add_argument(
+        "--frame-skip", type=int, default=1,
+        help="let the bot act every N frames only, learning from the coarser transitions"
+    )
+    parser.add_argument(
+        "--grid", default="10x10", help="state grid of the Q table (10x10 or 5x5), as it was initialized"
+    )
+    parser.add_argument(
+        "--sparse", action="store_true",
+        help="keep only the states reached so far, exporting only those (see sparse_qtable.py)"
+    )
+    parser.add_argument(
+        "--evict-every", type=int, default=0, help="with --sparse, evict cold states every N games"
+    )
+    parser.add_argument(
+        "--evict-visits", type=int, default=1,
+        help="states learned from fewer times than this in the run are cold..."
+    )
+    parser.add_argument(
+        "--evict-idle", type=int, default=500, help="...if they were not updated in this many games"
+    )
+    parser.add_argument(
+        "--shared", action="store_true",
+        help="with --workers, learn into one shared-memory table (Hogwild) instead of merging"
+    )
+    parser.add_argument(
+        "--stripes", type=int, default=0,
+        help="with --shared, lock the table by this many stripes of states (0: lock-free)"
+    )
+    parser.add_argument(
+        "--actors", type=int, default=0,
+        help="play in this many processes while this one only learns from their games"
+    )
+    parser.add_argument(
+        "--publish", type=int, default=50, help="with --actors, games between policy updates of the actors"
+    )
+    parser.add_argument(
+        "--learn-batch", type=int, default=16, help="with --actors, most games learned from at once"
+    )
+    parser.add_argument(
+        "--replay", type=int, default=0,
+        help="after every game, sweep this many past games again, drawn by how much they still teach"
+    )
+    parser.add_argument(
+        "--replay-size", type=int, default=500000, help="with --replay, most experiences kept to replay"
+    )
+    parser.add_argument(
+        "--replay-alpha", type=float, default=0.6,
+        help="with --replay, how strongly replay favors high priority games (0: uniform)"
+    )
     args = parser.parse_args()
+    if args.sparse and args.workers > 1:
+        parser.error("--sparse doesn't work with --workers, the workers merge dense tables")
+    if args.actors and (args.sparse or args.workers > 1 or args.learning != "sweep"):
+        parser.error("--actors needs a dense table, no --workers and --learning sweep")
+    if args.replay and (args.workers > 1 or args.learning != "sweep"):
+        parser.error("--replay needs --learning sweep and no --workers")
+    if args.actors and args.horizon is not None:
+        parser.error("--horizon doesn't work with --actors, the actors send whole games")
+    if args.frame_skip < 1:
+        parser.error("--frame-skip must be at least 1")
+    if args.horizon is not None and args.horizon < 2:
+        parser.error("--horizon must be at least 2, the last two experiences get the death reward")
     ITERATIONS = args.iter
+    try:
+        bot = Bot(grid=args.grid, sparse=args.sparse)
+    except GridError as e:
+        parser.error("%s (see --grid)" % e)
+    bot.evict_every = args.evict_every
+    bot.evict_min_visits = args.evict_visits
+    bot.evict_idle = args.evict_idle
+    bot.moves.horizon = args.horizon
+    bot.learning = args.learning
+    bot.use_state_cache(args.state_cache, args.cache_eviction)
     VERBOSE = args.verbose
-
-    # load dumped HITMASKS
-    with open("../data/hitmasks_data.pkl", "rb") as input:
-        HITMASKS = pickle.load(input)
-
-    while True:
-        movementInfo = showWelcomeAnimation()
-        crashInfo = mainGame(movementInfo)
-        showGameOverScreen(crashInfo)
-
-
-def showWelcomeAnimation():
-    """Shows welcome screen animation of flappy bird"""
-    # index of player to blit on screen
-    playerIndexGen = cycle([0, 1, 2, 1])
-
-    playery = int((SCREENHEIGHT - PLAYER[IM_HEIGTH]) / 2)
-
-    basex = 0
-
-    # player shm for up-down motion on welcome screen
-    playerShmVals = {"val": 0, "dir": 1}
-
-    return {
-        "playery": playery + playerShmVals["val"],
-        "basex": basex,
-        "playerIndexGen": playerIndexGen,
-    }
-
-
-def mainGame(movementInfo):
-
-    score = playerIndex = loopIter = 0
-    playerIndexGen = movementInfo["playerIndexGen"]
-
-    playerx, playery = int(SCREENWIDTH * 0.2), movementInfo["playery"]
-
-    basex = movementInfo["basex"]
-    baseShift = BASE[IM_WIDTH] - BACKGROUND[IM_WIDTH]
-
-    # get 2 new pipes to add to upperPipes lowerPipes list
-    newPipe1 = getRandomPipe()
-    newPipe2 = getRandomPipe()
-
-    # list of upper pipes
-    upperPipes = [
-        {"x": SCREENWIDTH + 200, "y": newPipe1[0]["y"]},
-        {"x": SCREENWIDTH + 200 + (SCREENWIDTH / 2), "y": newPipe2[0]["y"]},
-    ]
-
-    # list of lowerpipe
-    lowerPipes = [
-        {"x": SCREENWIDTH + 200, "y": newPipe1[1]["y"]},
-        {"x": SCREENWIDTH + 200 + (SCREENWIDTH / 2), "y": newPipe2[1]["y"]},
-    ]
-
-    pipeVelX = -4
-
-    # player velocity, max velocity, downward accleration, accleration on flap
-    playerVelY = -9  # player's velocity along Y, default same as playerFlapped
-    playerMaxVelY = 10  # max vel along Y, max descend speed
-    playerMinVelY = -8  # min vel along Y, max ascend speed
-    playerAccY = 1  # players downward accleration
-    playerFlapAcc = -9  # players speed on flapping
-    playerFlapped = False  # True when player flaps
-
-    while True:
-        if -playerx + lowerPipes[0]["x"] > -30:
-            myPipe = lowerPipes[0]
-        else:
-            myPipe = lowerPipes[1]
-
-        if bot.act(-playerx + myPipe["x"], -playery + myPipe["y"], playerVelY):
-            if playery > -2 * PLAYER[IM_HEIGTH]:
-                playerVelY = playerFlapAcc
-                playerFlapped = True
-
-        # check for crash here
-        crashTest = checkCrash(
-            {"x": playerx, "y": playery, "index": playerIndex}, upperPipes, lowerPipes
+    gaps = np.load(args.gaps) if args.gaps else None
+    # mainGame options of every game, also in the worker processes
+    play = {"max_frames": args.max_frames, "max_score": args.max_score, "frame_skip": args.frame_skip}
+    # (score, frames, censored) of every game, for the survival estimate of capped runs
+    capped = args.max_frames is not None or args.max_score is not None
+
+    if args.actors:
+        import parallel
+
+        bot.use_replay(args.replay, args.replay_size, args.replay_alpha)
+        RESULTS = parallel.train_actors(
+            bot, ITERATIONS, args.actors, args.publish, args.learn_batch, VERBOSE, args.seed, gaps, play
         )
-        if crashTest[0]:
-            # Update the q scores
-            bot.update_scores(dump_qvalues=False)
-
-            return {
-                "y": playery,
-                "groundCrash": crashTest[1],
-                "basex": basex,
-                "upperPipes": upperPipes,
-                "lowerPipes": lowerPipes,
-                "score": score,
-                "playerVelY": playerVelY,
-            }
-
-        # check for score
-        playerMidPos = playerx + PLAYER[IM_WIDTH] / 2
-        for pipe in upperPipes:
-            pipeMidPos = pipe["x"] + PIPE[IM_WIDTH] / 2
-            if pipeMidPos <= playerMidPos < pipeMidPos + 4:
-                score += 1
+        if capped and RESULTS:
+            showSurvival()
+        sys.exit()
 
-        # playerIndex basex change
-        if (loopIter + 1) % 3 == 0:
-            playerIndex = next(playerIndexGen)
-        loopIter = (loopIter + 1) % 30
-        basex = -((-basex + 100) % baseShift)
+    if args.workers > 1:
+        import parallel
 
-        # player's movement
-        if playerVelY < playerMaxVelY and not playerFlapped:
-            playerVelY += playerAccY
-        if playerFlapped:
-            playerFlapped = False
-        playerHeight = PLAYER[IM_HEIGTH]
-        playery += min(playerVelY, BASEY - playery - playerHeight)
+        if args.shared:
+            RESULTS = parallel.train_shared(
+                bot, ITERATIONS, args.workers, args.stripes, verbose=VERBOSE, seed=args.seed, gaps=gaps,
+                play=play
+            )
+        else:
+            RESULTS = parallel.train(
+                bot, ITERATIONS, args.workers, args.sync, args.merge, VERBOSE, args.seed, gaps, play
+            )
+        if capped and RESULTS:
+            showSurvival()
+        sys.exit()
 
-        # move pipes to left
-        for uPipe, lPipe in zip(upperPipes, lowerPipes):
-            uPipe["x"] += pipeVelX
-            lPipe["x"] += pipeVelX
+    # load dumped HITMASKS
+    HITMASKS = load_hitmasks("../data/hitmasks_data.pkl")
+    COLLISIONS = load_collision_table(HITMASKS, "../data/collision_table.npz")
 
-        # add new pipe when first pipe is about to touch left of screen
-        if 0 < upperPipes[0]["x"] < 5:
-            newPipe = getRandomPipe()
-            upperPipes.append(newPipe[0])
-            lowerPipes.append(newPipe[1])
+    env = GameEnv(args.seed, gaps)
+    bot.rng = env.explore_rng
+    bot.use_replay(args.replay, args.replay_size, args.replay_alpha)
+    profiler = Profiler(args.profile, log=args.profile_log) if args.profile > 0 else None
+    RESULTS = [] if capped else None
 
-        # remove first pipe if its out of the screen
-        if upperPipes[0]["x"] < -PIPE[IM_WIDTH]:
-            upperPipes.pop(0)
-            lowerPipes.pop(0)
+    while True:
+        movementInfo = showWelcomeAnimation()
+        crashInfo = mainGame(movementInfo, bot, COLLISIONS, env, profiler, **play)
+        showGameOverScreen(crashInfo)
 
 
 def showGameOverScreen(crashInfo):
     if VERBOSE:
         score = crashInfo["score"]
-        print(str(bot.gameCNT - 1) + " | " + str(score))
+        # a censored score is only a lower bound
+        print(str(bot.gameCNT - 1) + " | " + str(score) + ("+" if crashInfo["censored"] else ""))
+    if RESULTS is not None:
+        RESULTS.append((crashInfo["score"], crashInfo["frames"], crashInfo["censored"]))
 
     if bot.gameCNT == (ITERATIONS):
         bot.dump_qvalues(force=True)
+        if RESULTS:
+            showSurvival()
+        if bot.state_cache is not None:
+            print("State cache: " + str(bot.state_cache))
         sys.exit()
 
 
-def playerShm(playerShm):
-    """oscillates the value of playerShm['val'] between 8 and -8"""
-    if abs(playerShm["val"]) == 8:
-        playerShm["dir"] *= -1
-
-    if playerShm["dir"] == 1:
-        playerShm["val"] += 1
-    else:
-        playerShm["val"] -= 1
-
-
-def getRandomPipe():
-    """returns a randomly generated pipe"""
-    # y of gap between upper and lower pipe
-    gapY = random.randrange(0, int(BASEY * 0.6 - PIPEGAPSIZE))
-    gapY += int(BASEY * 0.2)
-    pipeHeight = PIPE[IM_HEIGTH]
-    pipeX = SCREENWIDTH + 10
-
-    return [
-        {"x": pipeX, "y": gapY - pipeHeight},  # upper pipe
-        {"x": pipeX, "y": gapY + PIPEGAPSIZE},  # lower pipe
-    ]
-
-
-def checkCrash(player, upperPipes, lowerPipes):
-    """returns True if player collders with base or pipes."""
-    pi = player["index"]
-    player["w"] = PLAYER[IM_WIDTH]
-    player["h"] = PLAYER[IM_HEIGTH]
-
-    # if player crashes into ground
-    if (player["y"] + player["h"] >= BASEY - 1) or (player["y"] + player["h"] <= 0):
-        return [True, True]
-    else:
-
-        playerRect = pygame.Rect(player["x"], player["y"], player["w"], player["h"])
-        pipeW = PIPE[IM_WIDTH]
-        pipeH = PIPE[IM_HEIGTH]
-
-        for uPipe, lPipe in zip(upperPipes, lowerPipes):
-            # upper and lower pipe rects
-            uPipeRect = pygame.Rect(uPipe["x"], uPipe["y"], pipeW, pipeH)
-            lPipeRect = pygame.Rect(lPipe["x"], lPipe["y"], pipeW, pipeH)
-
-            # player and upper/lower pipe hitmasks
-            pHitMask = HITMASKS["player"][pi]
-            uHitmask = HITMASKS["pipe"][0]
-            lHitmask = HITMASKS["pipe"][1]
-
-            # if bird collided with upipe or lpipe
-            uCollide = pixelCollision(playerRect, uPipeRect, pHitMask, uHitmask)
-            lCollide = pixelCollision(playerRect, lPipeRect, pHitMask, lHitmask)
-
-            if uCollide or lCollide:
-                return [True, False]
-
-    return [False, False]
-
-
-def pixelCollision(rect1, rect2, hitmask1, hitmask2):
-    """Checks if two objects collide and not just their rects"""
-    rect = rect1.clip(rect2)
-
-    if rect.width == 0 or rect.height == 0:
-        return False
-
-    x1, y1 = rect.x - rect1.x, rect.y - rect1.y
-    x2, y2 = rect.x - rect2.x, rect.y - rect2.y
-
-    for x in range(rect.width):
-        for y in range(rect.height):
-            if hitmask1[x1 + x][y1 + y] and hitmask2[x2 + x][y2 + y]:
-                return True
-    return False
+def showSurvival():
+    scores, frames, censored = zip(*RESULTS)
+    survival = survival_stats(scores, frames, censored)
+    print("%d of %d games censored at the cap, survival %.3f (95%% CI %.3f - %.3f)" % (
+        survival["censored"], len(scores), survival["survival"], *survival["survival_ci"]))
+    if survival["projected_score"] is not None:
+        print("projected mean game %.0f frames, mean score %.1f (constant death rate)" % (
+            survival["projected_frames"], survival["projected_score"]))
 
 
 if __name__ == "__main__":
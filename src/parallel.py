@@ -0,0 +1,331 @@
+import multiprocessing
+import queue
+import random
+
+import numpy as np
+
+from bot import Bot
+from qtable import QTable
+from game import GameEnv, mainGame, showWelcomeAnimation
+from hitmasks import load_collision_table, load_hitmasks
+from shared_qtable import SharedQTable
+
+
+def merge_tables(values, deltas, visits, mode="visits"):
+    """
+    Merge the Q-value changes of several workers into values, in place
+    mode "avg" averages the workers' tables
+    mode "visits" sums the deltas weighted by how often each worker visited a state
+    """
+    if mode == "avg":
+        values += np.mean(deltas, axis=0)
+    elif mode == "visits":
+        weights = np.asarray(visits, dtype=float)[:, :, None]
+        total = weights.sum(axis=0)
+        weighted = (np.asarray(deltas) * weights).sum(axis=0)
+        np.divide(weighted, total, out=weighted, where=total > 0)
+        values += weighted
+    else:
+        raise ValueError("unknown merge mode: %s" % mode)
+
+
+def _grid(bot):
+    """The grid of bot's table as its bins, which unlike a Discretizer can be pickled"""
+    d = bot.qtable.discretizer
+    return d.x_bins, d.y_bins, d.v_bins
+
+
+def _env(seed, gaps=None):
+    """
+    The GameEnv of a worker; with a gap corpus, starting at a seeded place in it, so that the
+    workers don't all meet the same pipes
+    """
+    env = GameEnv(seed, gaps)
+    if gaps is not None:
+        env.gap_pos = seed % len(gaps)
+    return env
+
+
+def _collisions():
+    """
+    The collision table, from its cache; loaded once by the parent before starting the workers,
+    so that they find the cache built instead of all building it at once
+    """
+    hitmasks = load_hitmasks("../data/hitmasks_data.pkl")
+    return load_collision_table(hitmasks, "../data/collision_table.npz")
+
+
+def _result(crashInfo):
+    """The (score, frames, censored) of a game, as the trainers return them"""
+    return crashInfo["score"], crashInfo["frames"], crashInfo["censored"]
+
+
+def _show(game, score, censored):
+    """The verbose line of a game; a censored score is only a lower bound"""
+    print(str(game) + " | " + str(score) + ("+" if censored else ""))
+
+
+def _init_worker(learning="sweep", grid="10x10", horizon=None, gaps=None):
+    """Give the worker process its own Bot and collision table"""
+    global BOT, COLLISIONS, GAPS
+
+    # the values come with every round, so the Q values file is not loaded
+    BOT = Bot(horizon=horizon, learning=learning, qtable=QTable(grid))
+    GAPS = gaps
+    COLLISIONS = _collisions()
+
+
+def _play_round(args):
+    """
+    Play a number of games with the worker's Bot, starting from the shared Q values
+    Returns the change in Q values, the visit counts and the (score, frames, censored) of the games
+    """
+    values, game_cnt, games, seed, play = args
+    BOT.qvalues[:] = values
+    BOT.qtable.visits[:] = 0
+    BOT.gameCNT = game_cnt
+    env = _env(seed, GAPS)
+    BOT.rng = env.explore_rng
+
+    results = []
+    for _ in range(games):
+        crashInfo = mainGame(showWelcomeAnimation(), BOT, COLLISIONS, env, **play)
+        results.append(_result(crashInfo))
+    return BOT.qvalues - values, BOT.qtable.visits.copy(), results
+
+
+def train(bot, iterations, workers, sync_every=25, merge="visits", verbose=False, seed=None, gaps=None,
+          play=None):
+    """
+    Train bot on iterations games spread across worker processes
+    Every worker plays up to sync_every games from the current Q values, then all updates are merged
+    With a seed, the worker rounds are seeded from it and the run is reproducible
+    The workers learn like bot (learning mode, grid, horizon), play the pipes of gaps if given, and
+    pass play (max_frames, max_score, frame_skip) on to mainGame
+    Returns the (score, frames, censored) of every game, for the survival estimate of capped games
+    """
+    rng = random.Random(seed)
+    play = play or {}
+    games_played = []
+    initargs = (bot.learning, _grid(bot), bot.moves.horizon, gaps)
+    _collisions()
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=initargs) as pool:
+        while bot.gameCNT < iterations:
+            remaining = iterations - bot.gameCNT
+            per_worker = min(sync_every, -(-remaining // workers))
+            jobs = []
+            for _ in range(workers):
+                games = min(per_worker, remaining)
+                if games <= 0:
+                    break
+                remaining -= games
+                jobs.append((bot.qvalues, bot.gameCNT, games, rng.getrandbits(32), play))
+
+            rounds = pool.map(_play_round, jobs)
+            deltas, visits, results = zip(*rounds)
+            merge_tables(bot.qvalues, deltas, visits, merge)
+            bot.qtable.visits += np.sum(visits, axis=0)
+
+            for result in (r for round_results in results for r in round_results):
+                bot.gameCNT += 1
+                games_played.append(result)
+                if verbose:
+                    _show(bot.gameCNT - 1, result[0], result[2])
+
+    bot.dump_qvalues(force=True)
+    return games_played
+
+
+def _join(processes):
+    """Wait for the processes, raising if any of them failed"""
+    for process in processes:
+        process.join()
+    failed = sum(process.exitcode != 0 for process in processes)
+    if failed:
+        raise RuntimeError("%d of %d worker processes failed" % (failed, len(processes)))
+
+
+def _shared_worker(table, counter, iterations, results, seed, learning="sweep", horizon=None, gaps=None,
+                   play=None):
+    """
+    Play games learning straight into the shared table, until iterations games have been claimed
+    Sends (game, (score, frames, censored)) for every game, then None, even if the worker fails
+    """
+    try:
+        bot = Bot(horizon=horizon, learning=learning, qtable=table)
+        collisions = _collisions()
+        env = _env(seed, gaps)
+        bot.rng = env.explore_rng
+
+        while True:
+            with counter.get_lock():
+                if counter.value >= iterations:
+                    break
+                game = counter.value
+                counter.value += 1
+            bot.gameCNT = game
+            crashInfo = mainGame(showWelcomeAnimation(), bot, collisions, env, **(play or {}))
+            results.put((game, _result(crashInfo)))
+    finally:
+        results.put(None)
+
+
+def train_shared(bot, iterations, workers, stripes=0, snapshot_every=100, verbose=False, seed=None,
+                 gaps=None, play=None):
+    """
+    Train bot on iterations games played by worker processes that all learn into one SharedQTable,
+    Hogwild-style: no merge step, and every update is seen by the other workers right away
+    stripes > 0 locks the table by stripes of states (see SharedQTable.locked)
+    A snapshot of the table is checkpointed every snapshot_every games
+    gaps, play and the returned games are as for train
+    """
+    rng = random.Random(seed)
+    games_played = []
+    table = SharedQTable(bot.qtable.discretizer, stripes)
+    table.values[:] = bot.qvalues
+    counter = multiprocessing.Value("l", bot.gameCNT)
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=_shared_worker,
+            args=(table, counter, iterations, results, rng.getrandbits(32), bot.learning,
+                  bot.moves.horizon, gaps, play)
+        )
+        for _ in range(workers)
+    ]
+    _collisions()
+    try:
+        for process in processes:
+            process.start()
+
+        done = 0
+        while done < workers:
+            result = results.get()
+            if result is None:
+                done += 1
+                continue
+            game, result = result
+            bot.gameCNT += 1
+            games_played.append(result)
+            if verbose:
+                _show(game, result[0], result[2])
+            if bot.gameCNT % snapshot_every == 0:
+                bot.checkpointer.submit(bot.gameCNT, table.snapshot())
+
+        _join(processes)
+        bot.qvalues[:] = table.values
+    finally:
+        table.close()
+        table.unlink()
+
+    bot.dump_qvalues(force=True)
+    return games_played
+
+
+class _ActorBot(Bot):
+    """
+    A Bot that plays from the published policy without learning: the episode it plays is kept
+    as an (n, 3) int32 array of (state, action, next state) for the actor to send instead
+    """
+
+    def __init__(self, policy):
+        super(_ActorBot, self).__init__(qtable=policy)
+        self.episode = None
+
+    def update_scores(self, dump_qvalues=True, censored=False):
+        if len(self.moves):
+            self.episode = self.moves.to_array()
+        self.moves.clear()
+
+
+def _actor(policy, counter, iterations, episodes, seed, gaps=None, play=None):
+    """
+    Play games from the published policy until iterations games have been claimed
+    Sends (game, episode, (score, frames, censored)) for every game, then None, even if the actor
+    fails
+    """
+    try:
+        bot = _ActorBot(policy)
+        collisions = _collisions()
+        env = _env(seed, gaps)
+        bot.rng = env.explore_rng
+
+        while True:
+            with counter.get_lock():
+                if counter.value >= iterations:
+                    break
+                game = counter.value
+                counter.value += 1
+            bot.gameCNT = game
+            crashInfo = mainGame(showWelcomeAnimation(), bot, collisions, env, **(play or {}))
+            if bot.episode is not None:
+                episodes.put((game, bot.episode, _result(crashInfo)))
+                bot.episode = None
+    finally:
+        episodes.put(None)
+
+
+def train_actors(bot, iterations, actors, publish_every=50, batch=16, verbose=False, seed=None,
+                 gaps=None, play=None):
+    """
+    Train bot on iterations games played by actor processes, which never wait for the learning
+    The actors play from a policy table in shared memory and queue their episodes; this process is
+    the learner: it sweeps the queued episodes into bot, up to batch of them per wake-up, and
+    copies bot's Q values into the policy every publish_every games
+    The actors read the policy without locks, so one may see a row half published
+    gaps, play and the returned games are as for train; the actors keep whole episodes, bot's
+    horizon doesn't apply
+    """
+    rng = random.Random(seed)
+    games_played = []
+    policy = SharedQTable(bot.qtable.discretizer)
+    policy.values[:] = bot.qvalues
+    counter = multiprocessing.Value("l", bot.gameCNT)
+    # bounded, so actors running ahead of the learner block instead of piling up episodes
+    episodes = multiprocessing.Queue(maxsize=4 * batch * actors)
+    processes = [
+        multiprocessing.Process(
+            target=_actor,
+            args=(policy, counter, iterations, episodes, rng.getrandbits(32), gaps, play)
+        )
+        for _ in range(actors)
+    ]
+    _collisions()
+    try:
+        for process in processes:
+            process.start()
+
+        done = 0
+        published = bot.gameCNT
+        while done < actors:
+            # wait for one episode, then take the ones already queued behind it
+            pending = [episodes.get()]
+            try:
+                while len(pending) < batch:
+                    pending.append(episodes.get_nowait())
+            except queue.Empty:
+                pass
+
+            for item in pending:
+                if item is None:
+                    done += 1
+                    continue
+                game, episode, result = item
+                bot.learn_episode(episode, result[2])
+                bot.gameCNT += 1
+                games_played.append(result)
+                if verbose:
+                    _show(game, result[0], result[2])
+                bot.dump_qvalues()
+
+            if bot.gameCNT - published >= publish_every:
+                policy.values[:] = bot.qvalues
+                published = bot.gameCNT
+
+        _join(processes)
+    finally:
+        policy.close()
+        policy.unlink()
+
+    bot.dump_qvalues(force=True)
+    return games_played
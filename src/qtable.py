@@ -0,0 +1,227 @@
+import argparse
+import contextlib
+import copy
+import json
+import os
+import struct
+
+import numpy as np
+
+from discretizer import GRIDS, Discretizer
+
+# Binary file: header, the X/Y/V bins as int32, zero padding, then the (n_states, 2) values
+BINARY_MAGIC = b"QTBL"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("<4sHHIIII")  # magic, version, dtype code, nx, ny, nv, data offset
+BINARY_DTYPES = {0: np.dtype("<f8"), 1: np.dtype("<f4")}
+BINARY_ALIGN = 64
+
+
+class GridError(ValueError):
+    """A table, or a log of its changes, is for another state grid than the one it is loaded into"""
+
+
+class QTable(object):
+    """
+    Q values of every (xdif, ydif, vel) grid cell, held in a preallocated (n_states, 2) array
+    A state is the integer row of its cell, as given by the Discretizer of the grid
+    Inputs falling outside the grid are clamped to the closest edge cell
+    """
+
+    def __init__(self, grid="10x10"):
+        self.discretizer = grid if isinstance(grid, Discretizer) else Discretizer(grid)
+        self.nx, self.ny, self.nv = self.discretizer.nx, self.discretizer.ny, self.discretizer.nv
+        self.n_states = self.discretizer.n_states
+        self.values = np.zeros((self.n_states, 2))
+        self.visits = np.zeros(self.n_states, dtype=np.int64)  # experiences learned from, per state
+        self.dirty = np.zeros(self.n_states, dtype=bool)  # states changed since the last dump
+        self.last_game = np.zeros(self.n_states, dtype=np.int64)  # game count of the last update
+
+        # Bin value of every state along each axis, used to rebuild keys and for reward shaping
+        self.xdif, self.ydif, self.vel = self.discretizer.cells()
+
+        self._x_pos = {x: i for i, x in enumerate(self.discretizer.x_bins)}
+        self._y_pos = {y: i for i, y in enumerate(self.discretizer.y_bins)}
+        self._v_pos = {v: i for i, v in enumerate(self.discretizer.v_bins)}
+
+    def index(self, xdif, ydif, vel):
+        """
+        Map raw (xdif, ydif, vel) to the state index, with regards to the grids
+        """
+        return self.discretizer.index(xdif, ydif, vel)
+
+    def clear(self):
+        """
+        Reset every Q value to zero
+        """
+        self.values = np.zeros((self.n_states, 2))
+
+    def grid_index(self, states):
+        """
+        The grid cell of each state, which is the state itself in a dense table
+        Grid indexes, unlike states, identify the same cell in any table of the grid
+        """
+        return np.asarray(states)
+
+    def cell_states(self, cells):
+        """
+        The state of each grid cell, the inverse of grid_index
+        """
+        return np.asarray(cells)
+
+    def assign(self, cells, rows):
+        """
+        Set the Q values of the given grid cells, skipping those off the grid
+        """
+        cells = np.asarray(cells)
+        inside = (cells >= 0) & (cells < self.n_states)
+        self.values[cells[inside]] = np.asarray(rows)[inside]
+
+    def locked(self, states):
+        """
+        Context serializing the updates of states across processes, a no-op for a private table
+        """
+        return contextlib.nullcontext()
+
+    def snapshot(self):
+        """
+        A copy of the table whose values are detached from this one
+        """
+        snapshot = copy.copy(self)
+        snapshot.values = np.array(self.values)
+        snapshot.visits = self.visits.copy()
+        return snapshot
+
+    def key(self, state):
+        """
+        The JSON key of a state, "xdif_ydif_vel"
+        """
+        return "%d_%d_%d" % (self.xdif[state], self.ydif[state], self.vel[state])
+
+    def key_index(self, key):
+        """
+        The state index of a JSON key, or None if the key is not a grid cell
+        """
+        try:
+            x, y, v = (int(part) for part in key.split("_"))
+            return (self._x_pos[x] * self.ny + self._y_pos[y]) * self.nv + self._v_pos[v]
+        except (KeyError, ValueError):
+            return None
+
+    def from_dict(self, qvalues):
+        """
+        Fill the table from a {"xdif_ydif_vel": [q0, q1]} dict
+        Raises GridError if the keys are not those of a table of this grid (see check_keys), rather
+        than losing or regridding its values
+        """
+        self.check_keys(qvalues)
+        self.values = np.zeros((self.n_states, 2))
+        for key, qs in qvalues.items():
+            self.values[self.key_index(key)] = qs[:2]
+
+    def check_keys(self, qvalues):
+        """
+        Raise GridError if a key is not a cell of the grid, or if every key is a cell of a coarser grid
+        of GRIDS: the cells of a coarser grid are also cells of a finer one, so its table would load
+        onto a fraction of the cells
+        """
+        off_grid = [key for key in qvalues if self.key_index(key) is None]
+        if off_grid:
+            raise GridError("%d keys are not cells of the state grid (e.g. %s), was the table made for "
+                            "another grid?" % (len(off_grid), off_grid[0]))
+
+        for name, bins in GRIDS.items():
+            if not qvalues or len(bins[0]) * len(bins[1]) * len(bins[2]) >= self.n_states:
+                continue
+            axes = [set(axis) for axis in bins]
+            if all(all(int(part) in axis for part, axis in zip(key.split("_"), axes)) for key in qvalues):
+                raise GridError("all %d keys are cells of the coarser %s grid, was the table made for "
+                                "it?" % (len(qvalues), name))
+
+    def to_dict(self):
+        """
+        Export the table as a {"xdif_ydif_vel": [q0, q1]} dict
+        """
+        rows = self.values.tolist()
+        return {self.key(state): rows[state] for state in range(self.n_states)}
+
+    def load_json(self, path):
+        with open(path, "r") as fil:
+            self.from_dict(json.load(fil))
+
+    def dump_json(self, path):
+        with open(path, "w") as fil:
+            json.dump(self.to_dict(), fil)
+
+    def dump_binary(self, path, dtype=np.float64):
+        """
+        Write the table in the binary format, through a temporary file so readers that
+        memory-mapped the previous version keep a consistent view
+        """
+        dtype = np.dtype(dtype).newbyteorder("<")
+        code = [c for c, d in BINARY_DTYPES.items() if d == dtype][0]
+        bins = np.array(self.discretizer.bins, dtype="<i4")
+        offset = -(-(BINARY_HEADER.size + bins.nbytes) // BINARY_ALIGN) * BINARY_ALIGN
+
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as fil:
+            fil.write(BINARY_HEADER.pack(
+                BINARY_MAGIC, BINARY_VERSION, code, self.nx, self.ny, self.nv, offset
+            ))
+            fil.write(bins.tobytes())
+            fil.write(b"\0" * (offset - BINARY_HEADER.size - bins.nbytes))
+            fil.write(np.ascontiguousarray(self.values, dtype=dtype).tobytes())
+        os.replace(tmp_path, path)
+
+    def load_binary(self, path, mode="r"):
+        """
+        Memory-map the values of a binary table file, without copying them
+        mode is passed to numpy.memmap: "r" read-only, "c" copy-on-write, "r+" writes to the file
+        """
+        with open(path, "rb") as fil:
+            header = fil.read(BINARY_HEADER.size)
+            if len(header) < BINARY_HEADER.size:
+                raise ValueError("%s is not a Q table file" % path)
+            magic, version, code, nx, ny, nv, offset = BINARY_HEADER.unpack(header)
+            if magic != BINARY_MAGIC or version != BINARY_VERSION or code not in BINARY_DTYPES:
+                raise ValueError("%s is not a Q table file" % path)
+            bins = np.frombuffer(fil.read(4 * (nx + ny + nv)), dtype="<i4").tolist()
+        if (nx, ny, nv) != (self.nx, self.ny, self.nv) or bins != self.discretizer.bins:
+            raise GridError("%s was written for a different state grid" % path)
+
+        self.values = np.memmap(
+            path, dtype=BINARY_DTYPES[code], mode=mode, offset=offset, shape=(self.n_states, 2)
+        )
+
+    def load(self, path, mode="r"):
+        """
+        Load a JSON or binary table, chosen by the file extension
+        """
+        if path.endswith(".json"):
+            self.load_json(path)
+        else:
+            self.load_binary(path, mode)
+
+    def dump(self, path):
+        if path.endswith(".json"):
+            self.dump_json(path)
+        else:
+            self.dump_binary(path, self.values.dtype)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser("qtable.py")
+    parser.add_argument("src", help="Q table to read, .json or binary")
+    parser.add_argument("dst", help="Q table to write, .json or binary")
+    parser.add_argument("--float32", action="store_true", help="store binary values as float32")
+    parser.add_argument("--grid", default="10x10", help="state grid of the table (10x10 or 5x5)")
+    args = parser.parse_args()
+
+    from checkpoint import load_qtable
+
+    qtable = QTable(args.grid)
+    load_qtable(qtable, args.src)
+    if args.dst.endswith(".json"):
+        qtable.dump_json(args.dst)
+    else:
+        qtable.dump_binary(args.dst, np.float32 if args.float32 else np.float64)
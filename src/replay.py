@@ -0,0 +1,77 @@
+import random
+
+import numpy as np
+
+# Replay of past episodes, so an expensive long game is learned from more than once
+
+
+class EpisodeReplay(object):
+    """
+    Past episodes kept for extra backward sweeps, up to capacity experiences in total
+    An episode is stored as the grid cells it went through (int32, one more than its experiences,
+    since every experience starts where the previous one ended) and its actions packed 8 per byte,
+    about 4.1 bytes per experience instead of 12; being grid cells, they survive the renumbering of
+    a sparse table
+    Episodes are sampled with probability proportional to priority ** alpha, the priority being how
+    much their last sweep changed the Q values (the summed absolute TD updates); once over capacity,
+    the lowest priority episodes are dropped first
+    """
+
+    MIN_PRIORITY = 1e-6  # episodes that no longer change anything are still replayed once in a while
+
+    def __init__(self, capacity=500000, alpha=0.6, rng=random):
+        self.capacity = capacity
+        self.alpha = alpha
+        self.rng = rng
+        self.cells = []
+        self.actions = []
+        self.lengths = []
+        self.censored = []
+        self.priorities = []
+        self.frames = 0
+
+    def __len__(self):
+        return len(self.cells)
+
+    def add(self, cells, acts, censored, priority):
+        """
+        Store an episode: the n + 1 grid cells it went through, its n actions, whether it was
+        censored, and the Q change of its first sweep
+        """
+        n = len(acts)
+        if not n or n > self.capacity:
+            return
+        self.cells.append(np.asarray(cells, dtype=np.int32))
+        self.actions.append(np.packbits(np.asarray(acts, dtype=bool)))
+        self.lengths.append(n)
+        self.censored.append(bool(censored))
+        self.priorities.append(max(float(priority), self.MIN_PRIORITY))
+        self.frames += n
+
+        while self.frames > self.capacity:
+            self._drop(min(range(len(self.priorities)), key=self.priorities.__getitem__))
+
+    def _drop(self, i):
+        self.frames -= self.lengths[i]
+        for episodes in (self.cells, self.actions, self.lengths, self.censored, self.priorities):
+            del episodes[i]
+
+    def sample(self, k):
+        """
+        Indexes of k episodes drawn by priority, with replacement
+        """
+        if not self.priorities:
+            return []
+        weights = [p ** self.alpha for p in self.priorities]
+        return self.rng.choices(range(len(weights)), weights=weights, k=k)
+
+    def episode(self, i):
+        """
+        Episode i as (cells, actions, next cells, censored), in play order
+        """
+        cells = self.cells[i]
+        acts = np.unpackbits(self.actions[i], count=self.lengths[i]).astype(np.int32)
+        return cells[:-1], acts, cells[1:], self.censored[i]
+
+    def update(self, i, priority):
+        self.priorities[i] = max(float(priority), self.MIN_PRIORITY)
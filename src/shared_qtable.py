@@ -0,0 +1,92 @@
+from contextlib import ExitStack
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from qtable import QTable
+
+
+class SharedQTable(QTable):
+    """
+    A QTable whose values live in shared memory, so several processes can learn into the same table
+    (Hogwild: updates are written without waiting for the other processes)
+    With stripes > 0, the states are split into that many stripes (state % stripes), each with a lock,
+    and locked() serializes the updates touching the same stripe
+    Visit counts and dirty flags stay private to each process
+    Pickling the table (e.g. as a multiprocessing.Process argument) attaches to the same memory
+    The creating process must close() and unlink() it once the other processes are done
+    """
+
+    def __init__(self, grid="10x10", stripes=0, name=None, locks=None):
+        super(SharedQTable, self).__init__(grid)
+        size = self.n_states * 2 * np.dtype(np.float64).itemsize
+        if name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+        else:
+            # Child processes share the creator's resource tracker, which unlinks the memory only if
+            # the creator never does
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.values = np.ndarray((self.n_states, 2), dtype=np.float64, buffer=self.shm.buf)
+        if self.owner:
+            self.values[:] = 0
+        self.locks = locks if locks is not None else [multiprocessing.Lock() for _ in range(stripes)]
+
+    def __getstate__(self):
+        d = self.discretizer
+        return {"grid": (d.x_bins, d.y_bins, d.v_bins), "name": self.shm.name, "locks": self.locks}
+
+    def __setstate__(self, state):
+        self.__init__(state["grid"], name=state["name"], locks=state["locks"])
+
+    def locked(self, states):
+        """
+        Context holding the locks of the stripes of states (none without stripes), taken in stripe
+        order so processes locking overlapping stripes can't deadlock
+        """
+        stack = ExitStack()
+        if self.locks:
+            n = len(self.locks)
+            for stripe in sorted({int(state) % n for state in np.asarray(states).reshape(-1).tolist()}):
+                stack.enter_context(self.locks[stripe])
+        return stack
+
+    def clear(self):
+        self.values[:] = 0
+
+    def load(self, path, mode="r"):
+        """
+        Copy a JSON or binary table into the shared values
+        """
+        table = QTable(self.discretizer)
+        table.load(path, mode)
+        self.values[:] = table.values
+
+    def from_dict(self, qvalues):
+        table = QTable(self.discretizer)
+        table.from_dict(qvalues)
+        self.values[:] = table.values
+
+    def assign(self, cells, rows):
+        with self.locked(cells):
+            super(SharedQTable, self).assign(cells, rows)
+
+    def snapshot(self):
+        """
+        A private QTable copy of the values, taken with every stripe locked
+        """
+        table = QTable(self.discretizer)
+        with self.locked(range(len(self.locks))):
+            table.values[:] = self.values
+        table.visits[:] = self.visits
+        return table
+
+    def close(self):
+        self.values = None
+        self.shm.close()
+
+    def unlink(self):
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,174 @@
+import copy
+
+import numpy as np
+
+from discretizer import Discretizer
+from qtable import QTable
+
+
+class SparseQTable(QTable):
+    """
+    Q values of only the grid cells that were actually reached, allocated on first sight
+    A state is a slot, the row of its cell in values; slots are handed out in order of first visit,
+    so unlike grid cells they differ between runs, and evict() renumbers them
+    The per-state arrays (values, visits, dirty, last_game, loaded, xdif, ydif, vel) have room for
+    `capacity` slots, the first n_states of which are in use; they grow by doubling
+    Cells never allocated have Q values [0, 0], so all-zero rows are not loaded from files
+    """
+
+    def __init__(self, grid="10x10", capacity=1024):
+        # No call to QTable.__init__, which would allocate the dense arrays
+        self.discretizer = grid if isinstance(grid, Discretizer) else Discretizer(grid)
+        self.nx, self.ny, self.nv = self.discretizer.nx, self.discretizer.ny, self.discretizer.nv
+        self._x_pos = {x: i for i, x in enumerate(self.discretizer.x_bins)}
+        self._y_pos = {y: i for i, y in enumerate(self.discretizer.y_bins)}
+        self._v_pos = {v: i for i, v in enumerate(self.discretizer.v_bins)}
+        self.capacity = capacity
+        self.clear()
+
+    def _resize(self, capacity):
+        def resized(array):
+            grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:self.n_states] = array[:self.n_states]
+            return grown
+
+        for name in ("values", "visits", "dirty", "last_game", "loaded", "cells", "xdif", "ydif", "vel"):
+            setattr(self, name, resized(getattr(self, name)))
+        self.capacity = capacity
+
+    def clear(self):
+        """
+        Drop every state
+        """
+        self.n_states = 0
+        self.slots = {}  # grid cell -> slot
+        self.values = np.zeros((self.capacity, 2))
+        self.visits = np.zeros(self.capacity, dtype=np.int64)
+        self.dirty = np.zeros(self.capacity, dtype=bool)
+        self.last_game = np.zeros(self.capacity, dtype=np.int64)
+        self.loaded = np.zeros(self.capacity, dtype=bool)  # loaded with non-zero values, never evicted
+        self.cells = np.zeros(self.capacity, dtype=np.int64)  # grid cell of every slot
+        self.xdif = np.zeros(self.capacity, dtype=np.int64)
+        self.ydif = np.zeros(self.capacity, dtype=np.int64)
+        self.vel = np.zeros(self.capacity, dtype=np.int64)
+
+    def slot(self, cell):
+        """
+        The state of a grid cell, allocating it with zero Q values if needed
+        """
+        state = self.slots.get(cell)
+        if state is not None:
+            return state
+        if self.n_states == self.capacity:
+            self._resize(2 * self.capacity)
+
+        state = self.n_states
+        self.n_states += 1
+        self.slots[cell] = state
+        self.cells[state] = cell
+        d = self.discretizer
+        self.xdif[state] = d.x_bins[cell // (d.ny * d.nv)]
+        self.ydif[state] = d.y_bins[(cell // d.nv) % d.ny]
+        self.vel[state] = d.v_bins[cell % d.nv]
+        return state
+
+    def index(self, xdif, ydif, vel):
+        """
+        Map raw (xdif, ydif, vel) to the state, allocating it on first sight
+        """
+        return self.slot(self.discretizer.index(xdif, ydif, vel))
+
+    def grid_index(self, states):
+        return self.cells[np.asarray(states)]
+
+    def cell_states(self, cells):
+        """
+        The state of each grid cell, allocating those not seen yet
+        """
+        return np.array([self.slot(cell) for cell in np.asarray(cells).tolist()], dtype=np.int64)
+
+    def assign(self, cells, rows):
+        """
+        Set the Q values of the given grid cells, skipping those off the grid
+        The table is only assigned to when loaded (from a binary file or a delta log), so the
+        non-zero rows count as loaded
+        """
+        for cell, row in zip(np.asarray(cells).tolist(), np.asarray(rows).tolist()):
+            if 0 <= cell < self.discretizer.n_states:
+                state = self.slot(cell)  # may reallocate values
+                self.values[state] = row
+                self.loaded[state] |= any(row)
+
+    def snapshot(self):
+        snapshot = copy.copy(self)
+        for name in ("values", "visits", "dirty", "last_game", "loaded", "cells", "xdif", "ydif", "vel"):
+            setattr(snapshot, name, getattr(self, name)[:self.n_states].copy())
+        snapshot.capacity = self.n_states
+        snapshot.slots = dict(self.slots)
+        return snapshot
+
+    def visited(self):
+        """
+        The states worth keeping: learned from this run, or holding non-zero Q values
+        """
+        n = self.n_states
+        return np.nonzero((self.visits[:n] > 0) | self.values[:n].any(axis=1))[0]
+
+    def from_dict(self, qvalues):
+        self.check_keys(qvalues)
+        self.clear()
+        for key, qs in qvalues.items():
+            cell = self.key_index(key)
+            if any(qs[:2]):
+                state = self.slot(cell)  # may reallocate values
+                self.values[state] = qs[:2]
+                self.loaded[state] = True
+
+    def to_dict(self):
+        """
+        Export the visited states only (see visited)
+        """
+        rows = self.values.tolist()
+        return {self.key(state): rows[state] for state in self.visited().tolist()}
+
+    def to_dense(self):
+        """
+        The table as a dense QTable of the same grid
+        """
+        dense = QTable(self.discretizer)
+        states = self.visited()
+        dense.values[self.cells[states]] = self.values[states]
+        return dense
+
+    def dump_binary(self, path, dtype=np.float64):
+        # The binary format is dense, so it can be memory-mapped
+        self.to_dense().dump_binary(path, dtype)
+
+    def load_binary(self, path, mode="r"):
+        dense = QTable(self.discretizer)
+        dense.load_binary(path, "r")
+        cells = np.nonzero(dense.values.any(axis=1))[0]
+        self.clear()
+        self.assign(cells, dense.values[cells])
+
+    def evict(self, min_visits=1, idle_games=0, game=0):
+        """
+        Drop the cold states: learned from fewer than min_visits times and not updated in the
+        idle_games games before game, then renumber the others in order
+        States loaded from a file with non-zero values are never cold, evicting them would drop
+        what earlier runs learned from the table file on the next dump
+        Returns the new state of every old one, -1 for the evicted ones
+        """
+        n = self.n_states
+        cold = (self.visits[:n] < min_visits) & (self.last_game[:n] < game - idle_games) & ~self.loaded[:n]
+        keep = np.nonzero(~cold)[0]
+        remap = np.full(n, -1, dtype=np.int64)
+        remap[keep] = np.arange(len(keep))
+
+        for name in ("values", "visits", "dirty", "last_game", "loaded", "cells", "xdif", "ydif", "vel"):
+            array = getattr(self, name)
+            array[:len(keep)] = array[keep]
+            array[len(keep):n] = 0
+        self.n_states = len(keep)
+        self.slots = {cell: state for state, cell in enumerate(self.cells[:len(keep)].tolist())}
+        return remap
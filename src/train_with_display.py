@@ -3,7 +3,6 @@ import random
 import sys
 import os
 import argparse
-import pickle
 
 import pygame
 from pygame.locals import *
@@ -11,9 +10,13 @@ from pygame.locals import *
 sys.path.append(os.getcwd())
 
 from bot import Bot
+from game import checkCrash
+from hitmasks import load_collision_table, load_hitmasks
+from instrument import Profiler
+from qtable import GridError
 
-# Initialize the bot
-bot = Bot()
+# The bot, created in main() once the grid is known
+bot = None
 
 SCREENWIDTH = 288
 SCREENHEIGHT = 512
@@ -46,21 +49,34 @@ PIPES_LIST = ("../data/assets/sprites/pipe-green.png",)
 
 
 def main():
-    global SCREEN, FPSCLOCK, HITMASKS, ITERATIONS, VERBOSE, DISPLAY_FREQ, bot
+    global SCREEN, FPSCLOCK, HITMASKS, COLLISIONS, ITERATIONS, VERBOSE, DISPLAY_FREQ, PROFILER, bot
 
     parser = argparse.ArgumentParser("train_with_display.py")
     parser.add_argument("--iter", type=int, default=1000, help="number of iterations to run")
     parser.add_argument("--display_freq", type=int, default=10, help="display every N iterations")
     parser.add_argument("--verbose", action="store_true", help="output [iteration | score] to stdout")
+    parser.add_argument("--learning", choices=Bot.LEARNING_MODES, default="sweep",
+                        help="update Q values after each game (sweep) or during it (td0, td_lambda)")
+    parser.add_argument("--grid", default="10x10",
+                        help="state grid of the Q table (10x10 or 5x5), as it was initialized")
+    parser.add_argument("--profile", type=int, default=0,
+                        help="time every phase of the game loop, printing a summary every N games")
+    parser.add_argument("--profile-log", default=None,
+                        help="also append every profile summary to this file, as JSON")
     args = parser.parse_args()
+    try:
+        bot = Bot(learning=args.learning, grid=args.grid)
+    except GridError as e:
+        parser.error("%s (see --grid)" % e)
+    PROFILER = Profiler(args.profile, log=args.profile_log) if args.profile > 0 else None
 
     ITERATIONS = args.iter
     VERBOSE = args.verbose
     DISPLAY_FREQ = args.display_freq
 
     # 加载碰撞掩码
-    with open("../data/hitmasks_data.pkl", "rb") as input_file:
-        HITMASKS = pickle.load(input_file)
+    HITMASKS = load_hitmasks("../data/hitmasks_data.pkl")
+    COLLISIONS = load_collision_table(HITMASKS, "../data/collision_table.npz")
 
     # 初始化pygame
     pygame.init()
@@ -217,8 +233,13 @@ def mainGame(movementInfo, display=True):
     playerFlapAcc = -9
     playerFlapped = False
 
+    profiler = PROFILER
+
     # 游戏主循环
     while True:
+        if profiler is not None:
+            lap = profiler.clock()
+
         # 事件处理（仅在显示模式下）
         if display:
             for event in pygame.event.get():
@@ -226,6 +247,8 @@ def mainGame(movementInfo, display=True):
                     bot.dump_qvalues(force=True)
                     pygame.quit()
                     sys.exit()
+            if profiler is not None:
+                lap = profiler.lap("events", lap)
 
         # AI决策
         if -playerx + lowerPipes[0]["x"] > -30:
@@ -239,16 +262,23 @@ def mainGame(movementInfo, display=True):
                 playerFlapped = True
                 if display:
                     SOUNDS["wing"].play()
+        if profiler is not None:
+            lap = profiler.lap("act", lap)
 
         # 碰撞检测
         crashTest = checkCrash(
             {"x": playerx, "y": playery, "index": playerIndex},
-            upperPipes, lowerPipes, display
+            upperPipes, lowerPipes, COLLISIONS
         )
+        if profiler is not None:
+            lap = profiler.lap("check_crash", lap)
 
         if crashTest[0]:
             # 更新Q值
             bot.update_scores(dump_qvalues=False)
+            if profiler is not None:
+                profiler.lap("update_scores", lap)
+                profiler.end_game()
 
             return {
                 "y": playery,
@@ -276,6 +306,11 @@ def mainGame(movementInfo, display=True):
                 score += 1
                 if display:
                     SOUNDS["point"].play()
+        if profiler is not None:
+            lap = profiler.lap("score", lap)
+            profiler.count("frames")
+            if playerFlapped:
+                profiler.count("flaps")
 
         # 更新玩家动画和地面
         if (loopIter + 1) % 3 == 0:
@@ -295,6 +330,8 @@ def mainGame(movementInfo, display=True):
             playerHeight = PLAYER[IM_HEIGTH]
 
         playery += min(playerVelY, BASEY - playery - playerHeight)
+        if profiler is not None:
+            lap = profiler.lap("player", lap)
 
         # 管道移动
         for uPipe, lPipe in zip(upperPipes, lowerPipes):
@@ -316,6 +353,8 @@ def mainGame(movementInfo, display=True):
         if upperPipes[0]["x"] < -pipe_width:
             upperPipes.pop(0)
             lowerPipes.pop(0)
+        if profiler is not None:
+            lap = profiler.lap("pipes", lap)
 
         # 显示（仅在显示模式下）
         if display:
@@ -337,6 +376,8 @@ def mainGame(movementInfo, display=True):
             SCREEN.blit(IMAGES["player"][playerIndex], (playerx, playery))
 
             pygame.display.update()
+            if profiler is not None:
+                lap = profiler.lap("render", lap)
             FPSCLOCK.tick(60)
 
 
@@ -410,69 +451,6 @@ def showScore(score):
         Xoffset += IMAGES["numbers"][digit].get_width()
 
 
-def checkCrash(player, upperPipes, lowerPipes, display=True):
-    """检测碰撞"""
-    pi = player["index"]
-
-    if display:
-        player["w"] = IMAGES["player"][0].get_width()
-        player["h"] = IMAGES["player"][0].get_height()
-        pipeW = IMAGES["pipe"][0].get_width()
-        pipeH = IMAGES["pipe"][0].get_height()
-    else:
-        player["w"] = PLAYER[IM_WIDTH]
-        player["h"] = PLAYER[IM_HEIGTH]
-        pipeW = PIPE[IM_WIDTH]
-        pipeH = PIPE[IM_HEIGTH]
-
-    # 检测是否撞到地面或天花板
-    if (player["y"] + player["h"] >= BASEY - 1) or (player["y"] + player["h"] <= 0):
-        return [True, True]
-    else:
-        playerRect = pygame.Rect(player["x"], player["y"], player["w"], player["h"])
-
-        for uPipe, lPipe in zip(upperPipes, lowerPipes):
-            # 上下管道矩形
-            uPipeRect = pygame.Rect(uPipe["x"], uPipe["y"], pipeW, pipeH)
-            lPipeRect = pygame.Rect(lPipe["x"], lPipe["y"], pipeW, pipeH)
-
-            # 碰撞掩码
-            if display:
-                pHitMask = HITMASKS["player"][pi]
-                uHitmask = HITMASKS["pipe"][0]
-                lHitmask = HITMASKS["pipe"][1]
-            else:
-                # 使用预加载的碰撞掩码
-                pHitMask = HITMASKS["player"][pi]
-                uHitmask = HITMASKS["pipe"][0]
-                lHitmask = HITMASKS["pipe"][1]
-
-            # 检测碰撞
-            uCollide = pixelCollision(playerRect, uPipeRect, pHitMask, uHitmask)
-            lCollide = pixelCollision(playerRect, lPipeRect, pHitMask, lHitmask)
-
-            if uCollide or lCollide:
-                return [True, False]
-
-    return [False, False]
-
-
-def pixelCollision(rect1, rect2, hitmask1, hitmask2):
-    """像素级碰撞检测"""
-    rect = rect1.clip(rect2)
-
-    if rect.width == 0 or rect.height == 0:
-        return False
-
-    x1, y1 = rect.x - rect1.x, rect.y - rect1.y
-    x2, y2 = rect.x - rect2.x, rect.y - rect2.y
-
-    for x in range(rect.width):
-        for y in range(rect.height):
-            if hitmask1[x1 + x][y1 + y] and hitmask2[x2 + x][y2 + y]:
-                return True
-    return False
-
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,89 @@
+import numpy as np
+
+import kernel
+from game import BASEY, PIPEGAPSIZE, SCREENWIDTH
+from hitmasks import load_collision_table, load_hitmasks
+from kernel import MAX_PIPES, START_Y
+
+
+class VecEnv(object):
+    """
+    N independent headless Flappy Bird games, advanced together one frame per step()
+    Follows the frame order of mainGame() in learn.py: observe, flap, check crash, score, move
+    Crashed games are restarted in place, so every step() returns a full batch of observations
+    The frames are played by step, a kernel.step_* function, the fastest one available by default
+    """
+
+    def __init__(self, n, hitmasks=None, seed=None, step=None):
+        self.n = n
+        self.kernel_step = step if step is not None else kernel.step
+        self.hitmasks = hitmasks if hitmasks is not None else load_hitmasks()
+        self.collisions = load_collision_table(self.hitmasks)
+        self.rng = np.random.default_rng(seed)
+
+        self.player_y = np.zeros(n)
+        self.player_vel = np.zeros(n, dtype=np.int64)
+        self.frames = np.zeros(n, dtype=np.int64)  # frames played in the current game
+        self.score = np.zeros(n, dtype=np.int64)
+        self.done = np.zeros(n, dtype=bool)
+        self.ground = np.zeros(n, dtype=bool)
+        self.spawned = np.zeros(n, dtype=bool)
+
+        # Pipe slots, the first n_pipes of each row are on screen, leftmost first
+        self.pipe_x = np.zeros((n, MAX_PIPES))
+        self.pipe_gap_y = np.zeros((n, MAX_PIPES), dtype=np.int64)
+        self.n_pipes = np.zeros(n, dtype=np.int64)
+
+        self.reset()
+
+    def _random_gaps(self, size):
+        """y of gap between upper and lower pipe, as in getRandomPipe()"""
+        return self.rng.integers(0, int(BASEY * 0.6 - PIPEGAPSIZE), size) + int(BASEY * 0.2)
+
+    def reset(self, mask=None):
+        """
+        Restart the games selected by mask (all games by default)
+        """
+        if mask is None:
+            mask = np.ones(self.n, dtype=bool)
+        count = int(mask.sum())
+        if count == 0:
+            return
+
+        self.player_y[mask] = START_Y
+        self.player_vel[mask] = -9
+        self.frames[mask] = 0
+        self.score[mask] = 0
+
+        self.pipe_x[mask] = [SCREENWIDTH + 200, SCREENWIDTH + 200 + (SCREENWIDTH / 2), 0]
+        gaps = np.zeros((count, MAX_PIPES), dtype=np.int64)
+        gaps[:, 0] = self._random_gaps(count)
+        gaps[:, 1] = self._random_gaps(count)
+        self.pipe_gap_y[mask] = gaps
+        self.n_pipes[mask] = 2
+
+    def observe(self):
+        """
+        The (xdif, ydif, vel) arrays that mainGame() would pass to bot.act() this frame
+        """
+        return kernel.observe(self.player_y, self.player_vel, self.pipe_x, self.pipe_gap_y)
+
+    def step(self, actions):
+        """
+        Advance every game by one frame, actions is an array of 0 (don't flap) / 1 (flap)
+        Returns (crashed, ground_crash, scores), where scores holds the final score of the
+        games that crashed this frame; those games are restarted before returning
+        """
+        self.kernel_step(
+            np.asarray(actions), self.player_y, self.player_vel, self.frames, self.score, self.pipe_x,
+            self.pipe_gap_y, self.n_pipes, self.collisions.table, self.collisions.dx_min,
+            self.collisions.dy_min, self.done, self.ground, self.spawned
+        )
+        spawn = np.nonzero(self.spawned)[0]
+        if len(spawn):
+            self.pipe_gap_y[spawn, self.n_pipes[spawn] - 1] = self._random_gaps(len(spawn))
+
+        crashed, ground = self.done.copy(), self.ground.copy()
+        scores = np.where(crashed, self.score, 0)
+        self.reset(crashed)
+        return crashed, ground, scores